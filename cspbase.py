@@ -1,5 +1,9 @@
 import time
 import functools
+import itertools
+import json
+import math
+import random
 
 '''Constraint Satisfaction Routines
    A) class Variable
@@ -30,6 +34,10 @@ import functools
       for each variable in the constraint (in the same ORDER as the
       variables of the constraint were specified).
 
+      The subclass CountConstraint instead specifies the constraint
+      "exactly N of the variables in the scope take value X" and works
+      by counting, without ever storing tuples.
+
     C) Backtracking routine---takes propagator and CSP as arguments
        so that basic backtracking, forward-checking or GAC can be 
        executed depending on the propagator used.
@@ -72,6 +80,12 @@ class Variable:
            flags are not changed so that pruning and unpruning can
            work independently of assignment and unassignment. 
            '''
+    #The flags of the current domain are kept as the bits of an integer
+    #(bit i set <=> dom[i] is current) together with a count of the set
+    #bits, so pruning, membership and size queries are all O(1).
+    __slots__ = ('name', 'dom', 'assignedValue', '_index', '_mask', '_size',
+                 'watchers', 'constraints')
+
     #
     #set up and info methods
     #
@@ -80,17 +94,39 @@ class Variable:
         string). Optionally specify the initial domain.
         '''
         self.name = name                #text name for variable
-        self.dom = list(domain)         #Make a copy of passed domain
-        self.curdom = [True] * len(domain)      #using list
+        self.dom = []                   #domain values
+        self._index = dict()            #map from value to its index in dom
+        self._mask = 0                  #bitmask of current domain
+        self._size = 0                  #number of bits set in _mask
         #for bt_search
         self.assignedValue = None
+        #constraints that keep counters over this variable, told of its
+        #assignments, unassignments and restored values (see add_watcher)
+        self.watchers = []
+        #constraints with this variable in their scope, whose counts of
+        #unassigned variables it keeps up to date (see Constraint.n_unasgn)
+        self.constraints = []
+        self.add_domain_values(domain)
 
     def add_domain_values(self, values):
         '''Add additional domain values to the domain
            Removals not supported removals'''
         for val in values: 
+            if not val in self._index:
+                self._index[val] = len(self.dom)
+                self._mask |= 1 << len(self.dom)
+                self._size = self._size + 1
             self.dom.append(val)
-            self.curdom.append(True)
+
+    def add_watcher(self, constraint):
+        '''Have constraint's assigned(var), unassigned(var) and
+           unpruned(var) methods called when this variable is assigned,
+           unassigned, or has values put back into its current domain'''
+        self.watchers.append(constraint)
+
+    def remove_watcher(self, constraint):
+        '''Stop calling constraint's methods (see add_watcher)'''
+        self.watchers.remove(constraint)
 
     def domain_size(self):
         '''Return the size of the (permanent) domain'''
@@ -100,59 +136,74 @@ class Variable:
         '''return the variable's (permanent) domain'''
         return(list(self.dom))
 
+    @property
+    def curdom(self):
+        '''list of flags, one per domain value, True if the value is
+           in the CURRENT domain'''
+        return [bool(self._mask >> i & 1) for i in range(len(self.dom))]
+
     #
     #methods for current domain (pruning and unpruning)
     #
 
     def prune_value(self, value):
         '''Remove value from CURRENT domain'''
-        self.curdom[self.value_index(value)] = False
+        bit = 1 << self._index[value]
+        if self._mask & bit:
+            self._mask ^= bit
+            self._size = self._size - 1
 
     def unprune_value(self, value):
         '''Restore value to CURRENT domain'''
-        self.curdom[self.value_index(value)] = True
+        bit = 1 << self._index[value]
+        if not self._mask & bit:
+            self._mask |= bit
+            self._size = self._size + 1
+            for c in self.watchers:
+                c.unpruned(self)
 
     def cur_domain(self):
         '''return list of values in CURRENT domain (if assigned 
            only assigned value is viewed as being in current domain)'''
-        vals = []
-        if self.is_assigned():
-            vals.append(self.get_assigned_value())
-        else:
-            for i, val in enumerate(self.dom):
-                if self.curdom[i]:
-                    vals.append(val)
-        return vals
+        if self.assignedValue is not None:
+            return [self.assignedValue]
+        mask = self._mask
+        return [val for i, val in enumerate(self.dom) if mask >> i & 1]
 
     def in_cur_domain(self, value):
         '''check if value is in CURRENT domain (without constructing list)
            if assigned only assigned value is viewed as being in current 
            domain'''
-        if not value in self.dom:
+        i = self._index.get(value)
+        if i is None:
             return False
-        if self.is_assigned():
-            return value == self.get_assigned_value()
-        else:
-            return self.curdom[self.value_index(value)]
+        if self.assignedValue is not None:
+            return value == self.assignedValue
+        return self._mask >> i & 1 == 1
 
     def cur_domain_size(self):
         '''Return the size of the variables domain (without construcing list)'''
-        if self.is_assigned():
+        if self.assignedValue is not None:
             return 1
-        else:
-            return(sum(1 for v in self.curdom if v))
+        return self._size
 
     def restore_curdom(self):
         '''return all values back into CURRENT domain'''
-        for i in range(len(self.curdom)):
-            self.curdom[i] = True
+        mask = self._mask
+        self._mask = 0
+        for i in self._index.values():
+            self._mask |= 1 << i
+        self._size = len(self._index)
+        if mask != self._mask:
+            for c in self.watchers:
+                c.unpruned(self)
 
     #
     #methods for assigning and unassigning
     #
 
     def is_assigned(self):
-        return self.assignedValue != None
+        return self.assignedValue is not None
     
     def assign(self, value):
         '''Used by bt_search. When we assign we remove all other values
@@ -165,12 +216,20 @@ class Variable:
             return
 
         self.assignedValue = value
+        for c in self.constraints:
+            c.n_unasgn = c.n_unasgn - 1
+        for c in self.watchers:
+            c.assigned(self)
 
     def unassign(self):
         '''Used by bt_search. Unassign and restore old curdom'''
         if not self.is_assigned():
             print("ERROR: trying to unassign variable", self, " not yet assigned")
             return
+        for c in self.constraints:
+            c.n_unasgn = c.n_unasgn + 1
+        for c in self.watchers:
+            c.unassigned(self)
         self.assignedValue = None
 
     def get_assigned_value(self):
@@ -184,7 +243,7 @@ class Variable:
     def value_index(self, value):
         '''Domain values need not be numbers, so return the index
            in the domain list of a variable value'''
-        return self.dom.index(value)
+        return self._index[value]
 
     def __repr__(self):
         return("Var-{}".format(self.name))
@@ -197,6 +256,45 @@ class Variable:
         print("Var--\"{}\": Dom = {}, CurDom = {}".format(self.name, 
                                                              self.dom, 
                                                              self.curdom))
+class TupleTable:
+    '''An immutable table of satisfying tuples that can be shared by
+       any number of constraints of the same arity (see
+       Constraint.set_satisfying_table). Supports are indexed by
+       position in the tuple rather than by variable.'''
+
+    def __init__(self, tuples):
+        self.sat_tuples = dict()
+        self.supports = dict()
+        for x in tuples:
+            t = tuple(x)
+            if t in self.sat_tuples:
+                continue
+            self.sat_tuples[t] = True
+            for i, val in enumerate(t):
+                if not (i, val) in self.supports:
+                    self.supports[(i, val)] = []
+                self.supports[(i, val)].append(t)
+        self.masks = None
+
+    def get_masks(self, arity):
+        '''Return the table's row masks (see row_masks) for tuples of
+           length arity, built on first use'''
+        if self.masks is None:
+            self.masks = row_masks(self.sat_tuples, arity)
+        return self.masks
+
+def row_masks(tuples, arity):
+    '''Return the compact form of a table: for each position of the
+       tuples, a dict from each value to the bitmask of the rows (the
+       tuples, numbered in order) having that value at that position'''
+    masks = [dict() for i in range(arity)]
+    bit = 1
+    for t in tuples:
+        for i, val in enumerate(t):
+            masks[i][val] = masks[i].get(val, 0) | bit
+        bit = bit << 1
+    return masks
+
 class Constraint: 
     '''Class for defining constraints variable objects specifes an
        ordering over variables.  This ordering is used when calling
@@ -221,6 +319,29 @@ class Constraint:
 
         self.scope = list(scope)
         self.name = name
+        self.n_csps = 0     #CSPs the constraint has been added to
+        self.init_tuples()
+
+    def attach(self):
+        '''Internal routine, called by CSP.add_constraint when the
+           constraint joins its first CSP. Set up 'n_unasgn', the number
+           of unassigned variables in the scope, and register with the
+           variables, which keep it up to date as they are assigned and
+           unassigned, so it never needs a rescan.'''
+        self.n_unasgn = 0
+        for var in self.scope:
+            var.constraints.append(self)
+            if not var.is_assigned():
+                self.n_unasgn = self.n_unasgn + 1
+
+    def detach(self):
+        '''Internal routine, called by CSP.remove_constraint when the
+           constraint leaves its last CSP. Unregister from the variables.'''
+        for var in self.scope:
+            var.constraints.remove(self)
+
+    def init_tuples(self):
+        '''Internal routine. Set up the (empty) table of satisfying tuples'''
         self.sat_tuples = dict()
 
         #The next object data item 'sup_tuples' will be used to help
@@ -228,9 +349,32 @@ class Constraint:
         #satisfying tuples that contain a particular variable/value
         #pair.
         self.sup_tuples = dict()
+        self.shared_table = False   #True if the two dicts above come
+                                    #from a TupleTable shared with others
+        self.table = None           #that TupleTable
+
+        #'masks' is the compact form of the table (see row_masks), used
+        #by get_unsupported to find the supports of all the variable/value
+        #pairs at once with a few bitwise operations per pair. Built on
+        #first use.
+        self.masks = None
+
+        #'residues' caches, for each variable/value pair, the last
+        #supporting tuple found by has_support. It is checked first on
+        #the next call and, being only a hint, never needs restoring on
+        #backtrack.
+        self.residues = dict()
 
     def add_satisfying_tuples(self, tuples):
         '''We specify the constraint by adding its complete list of satisfying tuples.'''
+        if self.shared_table:
+            #take private copies before modifying a shared table
+            self.sat_tuples = dict(self.sat_tuples)
+            for key in self.sup_tuples:
+                self.sup_tuples[key] = list(self.sup_tuples[key])
+            self.shared_table = False
+            self.table = None
+        self.masks = None
         for x in tuples:
             t = tuple(x)  #ensure we have an immutable tuple
             if not t in self.sat_tuples:
@@ -243,6 +387,18 @@ class Constraint:
                     self.sup_tuples[(var,val)] = []
                 self.sup_tuples[(var,val)].append(t)
 
+    def set_satisfying_table(self, table):
+        '''Specify the constraint by a prebuilt TupleTable instead.
+           The table's tuples and support lists are shared, not copied,
+           so many constraints can use the same table.'''
+        self.sat_tuples = table.sat_tuples
+        self.sup_tuples = dict()
+        for (i, val), tuples in table.supports.items():
+            self.sup_tuples[(self.scope[i], val)] = tuples
+        self.shared_table = True
+        self.table = table
+        self.masks = None
+
     def get_scope(self):
         '''get list of variables the constraint is over'''
         return list(self.scope)
@@ -257,13 +413,24 @@ class Constraint:
         return tuple(vals) in self.sat_tuples
 
     def get_n_unasgn(self):
-        '''return the number of unassigned variables in the constraint's scope'''
+        '''return the number of unassigned variables in the constraint's
+           scope, O(1) once the constraint is in a CSP'''
+        if self.n_csps:
+            return self.n_unasgn
         n = 0
         for v in self.scope:
             if not v.is_assigned():
                 n = n + 1
         return n
 
+    def get_unasgn_var(self):
+        '''return the first unassigned variable in the constraint's scope,
+           None if all are assigned (without constructing a list)'''
+        for v in self.scope:
+            if not v.is_assigned():
+                return v
+        return None
+
     def get_unasgn_vars(self): 
         '''return list of unassigned variables in constraint's scope. Note
            more expensive to get the list than to then number'''
@@ -279,11 +446,46 @@ class Constraint:
            still in the corresponding variables current domain
         '''
         if (var, val) in self.sup_tuples:
+            t = self.residues.get((var, val))
+            if t is not None and self.tuple_is_valid(t):
+                return True
             for t in self.sup_tuples[(var, val)]:
                 if self.tuple_is_valid(t):
+                    self.residues[(var, val)] = t
                     return True
         return False
 
+    def count_support(self, var, val):
+        '''Return the number of satisfying tuples with var = val whose
+           values are all still in the current domains'''
+        i = self.scope.index(var)
+        rows = self.get_valid_rows() & self.get_masks()[i].get(val, 0)
+        return bin(rows).count("1")
+
+    def get_masks(self):
+        '''Return the compact form of the table (see row_masks), shared
+           with the TupleTable if the constraint uses one'''
+        if self.masks is None:
+            if self.table is not None:
+                self.masks = self.table.get_masks(len(self.scope))
+            else:
+                self.masks = row_masks(self.sat_tuples, len(self.scope))
+        return self.masks
+
+    def get_valid_rows(self):
+        '''Return the bitmask of the rows of the table (see row_masks)
+           whose values are all still in the current domains'''
+        masks = self.get_masks()
+        valid = (1 << len(self.sat_tuples)) - 1
+        for i, var in enumerate(self.scope):
+            allowed = 0
+            for val in var.cur_domain():
+                allowed = allowed | masks[i].get(val, 0)
+            valid = valid & allowed
+            if not valid:
+                break
+        return valid
+
     def tuple_is_valid(self, t):
         '''Internal routine. Check if every value in tuple is still in
            corresponding variable domains'''
@@ -292,9 +494,264 @@ class Constraint:
                 return False
         return True
 
+    #True for constraints whose bounds should be checked on every
+    #assignment by forward checking, not only when one variable is left
+    incremental = False
+
+    def get_unsupported(self):
+        '''Return list of (Variable, value) pairs, taken from the current
+           domains of the variables in the scope, that have no support
+           in this constraint. Used by GAC to revise the constraint.
+
+           Works on the compact table: the valid rows are found once,
+           then a value is supported if its row mask meets them.'''
+        masks = self.get_masks()
+        valid = self.get_valid_rows()
+        unsupported = []
+        for i, var in enumerate(self.scope):
+            for val in var.cur_domain():
+                if not valid & masks[i].get(val, 0):
+                    unsupported.append((var, val))
+        return unsupported
+
     def __str__(self):
         return("{}({})".format(self.name,[var.name for var in self.scope]))
 
+class LazyConstraint(Constraint):
+    '''A table constraint that is only built when it is first used.
+
+       Until then it holds just its name, scope and 'build', a function
+       of no arguments returning the constraint's TupleTable. The first
+       time the tuples are needed (to check values, or when a propagator
+       first asks for support) build is called and the constraint turns
+       into an ordinary table Constraint over the table. Constraints that
+       search never reaches cost no time or space for their tables, which
+       only helps propagators that do not revise every constraint at the
+       root (prop_BT, prop_FC): initial GAC builds them all.'''
+
+    def __init__(self, name, scope, build):
+        '''create a lazy constraint, specify the constraint name, its
+           scope and the function building its TupleTable'''
+        self.scope = list(scope)
+        self.name = name
+        self.build = build
+        self.n_csps = 0
+
+    def __getattr__(self, name):
+        #only called for attributes not yet set, i.e., before loading
+        if name in ('sat_tuples', 'sup_tuples', 'shared_table', 'table', 'residues',
+                    'masks') and \
+           self.build is not None:
+            self.load()
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    def load(self):
+        '''Build the constraint's tuples now (if not done already)'''
+        if self.build is None:
+            return
+        build = self.build
+        self.build = None
+        self.init_tuples()
+        self.set_satisfying_table(build())
+
+    def is_loaded(self):
+        '''return True if the tuples have been built'''
+        return self.build is None
+
+    def add_satisfying_tuples(self, tuples):
+        '''Add tuples to those of the (loaded) constraint'''
+        self.load()
+        Constraint.add_satisfying_tuples(self, tuples)
+
+class CountConstraint(Constraint):
+    '''Constraint specifying that exactly 'count' of the variables in
+       its scope take the value 'value' (e.g., a minesweeper clue saying
+       exactly N of the surrounding cells hold a mine).
+
+       No satisfying tuples are stored. Checking, support testing and
+       pruning are done by counting how many variables of the scope
+       must take the value (it is the only value left in their current
+       domain) and how many can still take it. So the space used is
+       linear in the size of the scope rather than exponential.'''
+
+    def __init__(self, name, scope, value, count):
+        '''create a counting constraint, specify the constraint name,
+           its scope, the value being counted and the required count'''
+        Constraint.__init__(self, name, scope)
+        self.value = value
+        self.count = count
+
+    def add_satisfying_tuples(self, tuples):
+        '''Counting constraints are not specified by tuples'''
+        print("Trying to add satisfying tuples to counting constraint", self)
+
+    def check(self, vals):
+        '''Return true if exactly 'count' of the values (ordered as the
+           scope) are equal to the counted value'''
+        n = 0
+        for val in vals:
+            if val == self.value:
+                n = n + 1
+        return n == self.count
+
+    def get_counts(self):
+        '''Return the pair (n_must, n_can). n_must is the number of
+           variables in the scope that must take the counted value, n_can
+           the number that still have it in their current domain'''
+        n_must = 0
+        n_can = 0
+        for var in self.scope:
+            if var.in_cur_domain(self.value):
+                n_can = n_can + 1
+                if var.cur_domain_size() == 1:
+                    n_must = n_must + 1
+        return n_must, n_can
+
+    def has_support(self, var, val):
+        '''Test if a variable value pair has support, i.e., if after
+           setting var = val the remaining variables of the scope can
+           still make up exactly 'count' occurrences of the value'''
+        if not var in self.scope or not var.in_cur_domain(val):
+            return False
+        n_must, n_can = self.get_counts()
+        #take out var's own contribution to the counts
+        if var.in_cur_domain(self.value):
+            n_can = n_can - 1
+            if var.cur_domain_size() == 1:
+                n_must = n_must - 1
+        need = self.count
+        if val == self.value:
+            need = need - 1
+        return n_must <= need <= n_can
+
+    def count_support(self, var, val):
+        '''Return the number of ways to satisfy the constraint with
+           var = val: the ways to choose which of the other variables that
+           can take the value but need not, take it'''
+        if not var in self.scope or not var.in_cur_domain(val):
+            return 0
+        n_must, n_can = self.get_counts()
+        if var.in_cur_domain(self.value):
+            n_can = n_can - 1
+            if var.cur_domain_size() == 1:
+                n_must = n_must - 1
+        need = self.count - n_must
+        if val == self.value:
+            need = need - 1
+        if need < 0 or need > n_can - n_must:
+            return 0
+        return math.comb(n_can - n_must, need)
+
+    def get_unsupported(self):
+        '''Return the unsupported (Variable, value) pairs using a single
+           pass over the scope to compute the counts'''
+        n_must, n_can = self.get_counts()
+        unsupported = []
+        if n_must > self.count or n_can < self.count:
+            #no way left to satisfy the constraint: nothing is supported
+            for var in self.scope:
+                for val in var.cur_domain():
+                    unsupported.append((var, val))
+        elif n_must == self.count:
+            #count reached, variables still free must avoid the value
+            for var in self.scope:
+                if var.cur_domain_size() > 1 and var.in_cur_domain(self.value):
+                    unsupported.append((var, self.value))
+        elif n_can == self.count:
+            #every variable that can take the value must take it
+            for var in self.scope:
+                if var.cur_domain_size() > 1 and var.in_cur_domain(self.value):
+                    for val in var.cur_domain():
+                        if val != self.value:
+                            unsupported.append((var, val))
+        return unsupported
+
+class TotalCountConstraint(CountConstraint):
+    '''A CountConstraint meant for very large scopes, e.g., "the board
+       holds N mines" over every unknown cell of a minesweeper board.
+
+       Rather than rescanning its scope the constraint watches its
+       variables (see Variable.add_watcher) and keeps the number of
+       variables assigned the value up to date as they are assigned and
+       unassigned. With the number still unassigned (n_unasgn, kept for
+       every constraint) this bounds the count in O(1), so
+       get_unsupported costs O(1) per assignment. Only when the bounds
+       become tight (the count is reached, or every unassigned variable
+       is needed) does it force the unassigned variables, and it
+       remembers having done so until a value of its scope is put back.'''
+
+    incremental = True
+
+    def __init__(self, name, scope, value, count):
+        CountConstraint.__init__(self, name, scope, value, count)
+        self.n_value = 0        #variables assigned the value
+        self.forced_at = None   #n_unasgn when the unassigned variables were
+                                #last forced, None if they are not
+
+    def attach(self):
+        '''Also watch the variables (while in a CSP) and count those
+           assigned the value'''
+        CountConstraint.attach(self)
+        self.n_value = 0
+        self.forced_at = None
+        for var in self.scope:
+            var.add_watcher(self)
+            if var.get_assigned_value() == self.value:
+                self.n_value = self.n_value + 1
+
+    def detach(self):
+        CountConstraint.detach(self)
+        for var in self.scope:
+            var.remove_watcher(self)
+
+    def assigned(self, var):
+        if var.get_assigned_value() == self.value:
+            self.n_value = self.n_value + 1
+
+    def unassigned(self, var):
+        #n_unasgn already counts var again (see Variable.unassign)
+        if var.get_assigned_value() == self.value:
+            self.n_value = self.n_value - 1
+        if self.forced_at is not None and self.n_unasgn > self.forced_at:
+            self.forced_at = None
+
+    def unpruned(self, var):
+        self.forced_at = None
+
+    def get_unsupported(self):
+        '''Return the unsupported (Variable, value) pairs implied by the
+           counters: nothing unless the bounds are tight'''
+        if self.n_value > self.count or self.n_value + self.n_unasgn < self.count:
+            #cannot be satisfied, wipe out the domain of an unassigned variable
+            for var in self.scope:
+                if not var.is_assigned():
+                    return [(var, val) for val in var.cur_domain()]
+            return []
+        if self.forced_at is not None:
+            return []
+        if self.n_value < self.count and self.n_value + self.n_unasgn > self.count:
+            return []
+
+        #tight: every unassigned variable must (or must not) take the value
+        take = self.n_value < self.count
+        unsupported = []
+        for var in self.scope:
+            if var.is_assigned():
+                continue
+            if not take:
+                if var.in_cur_domain(self.value):
+                    unsupported.append((var, self.value))
+            elif var.in_cur_domain(self.value):
+                for val in var.cur_domain():
+                    if val != self.value:
+                        unsupported.append((var, val))
+            else:
+                for val in var.cur_domain():
+                    unsupported.append((var, val))
+        self.forced_at = self.n_unasgn
+        return unsupported
+
 class CSP:
     '''Class for packing up a set of variables into a CSP problem.
        Contains various utility routines for accessing the problem.
@@ -326,7 +783,7 @@ class CSP:
     def add_constraint(self,c):
         '''Add constraint to CSP. Note that all variables in the 
            constraints scope must already have been added to the CSP'''
-        if not type(c) is Constraint:
+        if not isinstance(c, Constraint):
             print("Trying to add non constraint ", c, " to CSP object")
         else:
             for v in c.scope:
@@ -335,6 +792,21 @@ class CSP:
                     return
                 self.vars_to_cons[v].append(c)
             self.cons.append(c)
+            if c.n_csps == 0:
+                c.attach()
+            c.n_csps = c.n_csps + 1
+
+    def remove_constraint(self,c):
+        '''Remove a constraint previously added to the CSP'''
+        if not c in self.cons:
+            print("Trying to remove constraint ", c, " not in CSP object")
+        else:
+            for v in c.scope:
+                self.vars_to_cons[v].remove(c)
+            self.cons.remove(c)
+            c.n_csps = c.n_csps - 1
+            if c.n_csps == 0:
+                c.detach()
 
     def get_all_cons(self):
         '''return list of all constraints in the CSP'''
@@ -348,6 +820,48 @@ class CSP:
         '''return list of variables in the CSP'''
         return list(self.vars)
 
+    def get_components(self, exclude=()):
+        '''Return list of the connected components of the CSP. Each
+           component is a list of variables; two variables are connected
+           if some constraint has both in its scope. Components can be
+           solved independently of each other. Constraints in exclude
+           are ignored (e.g., a total count spanning every variable).'''
+        components = []
+        seen_vars = set()
+        seen_cons = set(exclude)
+        for v in self.vars:
+            if v in seen_vars:
+                continue
+            seen_vars.add(v)
+            component = [v]
+            i = 0
+            while i < len(component):
+                for c in self.vars_to_cons[component[i]]:
+                    if c in seen_cons:
+                        continue
+                    seen_cons.add(c)
+                    for w in c.scope:
+                        if not w in seen_vars:
+                            seen_vars.add(w)
+                            component.append(w)
+                i = i + 1
+            components.append(component)
+        return components
+
+    def get_sub_csp(self, name, vars):
+        '''Return a CSP over the variables vars (e.g., a component) with
+           the constraints of this CSP whose scope lies within vars. The
+           variable and constraint objects are shared, not copied.'''
+        sub = CSP(name, vars)
+        added = set()
+        for v in sub.vars:
+            for c in self.vars_to_cons[v]:
+                if not c in added:
+                    added.add(c)
+                    if all(w in sub.vars_to_cons for w in c.scope):
+                        sub.add_constraint(c)
+        return sub
+
     def print_all(self):
         print("CSP", self.name)
         print("   Variables = ", self.vars)
@@ -360,10 +874,389 @@ class CSP:
             print(v, " = ", v.get_assigned_value(), "    ", end='')
         print("")
 
+########################################################
+# Trail of prunings                                    #
+########################################################
+
+class Trail:
+    '''Stack of the value prunings made during search, so that they
+       can be undone when search backtracks. Before propagating, the
+       search takes a mark (the current height of the trail); the
+       propagator pushes each value it prunes; undoing back to the mark
+       restores exactly those values, most recent first.
+
+       The pruned variables and values are kept in two parallel lists
+       so that recording a pruning allocates no tuple.'''
+
+    def __init__(self, listeners=()):
+        self.vars = []
+        self.vals = []
+        #search listeners told of each constraint revision made by the
+        #propagators (see SearchListener.revised), empty if none
+        self.listeners = listeners
+
+    def __len__(self):
+        return len(self.vars)
+
+    def prune(self, var, val, constraint=None):
+        '''Prune val from the current domain of var and record it.
+           constraint is the constraint found to not support the value,
+           if any (see ExplainingTrail).'''
+        var.prune_value(val)
+        self.vars.append(var)
+        self.vals.append(val)
+
+    def record(self, var, val):
+        '''Record a pruning that has already been made'''
+        self.vars.append(var)
+        self.vals.append(val)
+
+    def mark(self):
+        '''Return a marker for the current level of the trail'''
+        return len(self.vars)
+
+    def pop(self):
+        '''Undo the most recent pruning, returning its variable'''
+        var = self.vars.pop()
+        var.unprune_value(self.vals.pop())
+        return var
+
+    def undo(self, mark):
+        '''Undo all prunings made since mark was taken'''
+        while len(self.vars) > mark:
+            self.pop()
+
+    def get_prunings(self, mark=0):
+        '''Return list of (Variable, value) pairs pruned since mark'''
+        return list(zip(self.vars[mark:], self.vals[mark:]))
+
+    def fail(self, constraint):
+        '''Report that constraint is violated by the current assignment
+           (see ExplainingTrail)'''
+
+class ExplainingTrail(Trail):
+    '''Trail that also records why each value was pruned, for
+       conflict-directed backjumping (see BT.cbj_on).
+
+       A reason is a bitmask of decision levels: bit k stands for the
+       decision made at level k of the search, bit 0 for the root (the
+       constraints alone). The reason of a pruning made by a constraint
+       is taken to be the levels of the other assigned variables of its
+       scope together with the reasons of the values already missing
+       from its other unassigned variables. Prunings made without a
+       constraint (by propagators that return their prunings) or by a
+       constraint with incremental counters (spanning e.g. the whole
+       board) are blamed on every level.'''
+
+    def __init__(self, listeners=()):
+        Trail.__init__(self, listeners)
+        self.reasons = []           #reason of each pruning, parallel to vars
+        self.saved = []             #var_reason of the pruned variable before each pruning
+        self.var_reason = dict()    #variable -> reasons of the values missing from its domain
+        self.level = dict()         #assigned variable -> level of its decision
+        self.depth = 0              #current decision level
+        self.conflict = None        #reason of the violation reported by fail
+
+    def all_levels(self):
+        '''Return the reason blaming every level up to the current one'''
+        return (1 << (self.depth + 1)) - 1
+
+    def explain(self, constraint, var=None):
+        '''Return the reason for constraint's pruning of a value of var
+           (or for its violation if var is None)'''
+        if constraint is None or constraint.incremental:
+            return self.all_levels()
+        reason = 0
+        for w in constraint.scope:
+            if w is not var:
+                level = self.level.get(w)
+                if level is not None:
+                    reason |= 1 << level
+                else:
+                    reason |= self.var_reason.get(w, 0)
+        return reason
+
+    def prune(self, var, val, constraint=None):
+        self.prune_because(var, val, self.explain(constraint, var))
+
+    def prune_because(self, var, val, reason):
+        '''Prune val from the current domain of var, with the given reason'''
+        Trail.prune(self, var, val)
+        self.push_reason(var, reason)
+
+    def record(self, var, val):
+        Trail.record(self, var, val)
+        self.push_reason(var, self.all_levels())
+
+    def push_reason(self, var, reason):
+        old = self.var_reason.get(var, 0)
+        self.reasons.append(reason)
+        self.saved.append(old)
+        self.var_reason[var] = old | reason
+
+    def pop(self):
+        var = Trail.pop(self)
+        self.reasons.pop()
+        self.var_reason[var] = self.saved.pop()
+        return var
+
+    def fail(self, constraint):
+        self.conflict = self.explain(constraint)
+
+    def get_conflict(self, mark):
+        '''Return the reason of the failure of the propagation whose
+           prunings start at mark: that of a violation reported by fail,
+           else that of the values of the variable wiped out last, else
+           every level'''
+        conflict = self.conflict
+        self.conflict = None
+        if conflict is not None:
+            return conflict
+        if len(self.vars) > mark and self.vars[-1].cur_domain_size() == 0:
+            return self.var_reason[self.vars[-1]]
+        return self.all_levels()
+
+class NogoodStore:
+    '''Size-bounded store of the nogoods learned by backjumping search:
+       sets of (Variable, value) decisions that cannot all hold in a
+       solution. They are indexed by each of their decisions. Once the
+       store holds 'size' nogoods the oldest is forgotten for each new
+       one.'''
+
+    def __init__(self, size):
+        self.size = size
+        self.nogoods = dict()   #nogood (frozenset) -> True, oldest first
+        self.watch = dict()     #(Variable, value) -> nogoods containing it
+
+    def __len__(self):
+        return len(self.nogoods)
+
+    def add(self, nogood):
+        '''Store nogood, an iterable of (Variable, value) pairs'''
+        nogood = frozenset(nogood)
+        if self.size <= 0 or nogood in self.nogoods:
+            return
+        if len(self.nogoods) >= self.size:
+            old = next(iter(self.nogoods))
+            del self.nogoods[old]
+            for pair in old:
+                self.watch[pair].remove(old)
+                if not self.watch[pair]:
+                    del self.watch[pair]
+        self.nogoods[nogood] = True
+        for pair in nogood:
+            self.watch.setdefault(pair, []).append(nogood)
+
+    def get(self, var, val):
+        '''Return the nogoods containing the decision var = val'''
+        return self.watch.get((var, val), ())
+
+def trail_propagator(propagator):
+    '''Decorator for propagators written against the trail. The
+       decorated function has the template
+
+       propagator(csp, newVar=None, trail=None)
+
+       When a Trail is passed, the propagator pushes its prunings onto
+       it and only the status (True/False) is returned. When called
+       without a trail it follows the older template and returns
+       (status, [(Variable, Value), ...]) with the values it pruned.'''
+
+    @functools.wraps(propagator)
+    def wrapper(csp, newVar=None, trail=None):
+        if trail is not None:
+            return propagator(csp, newVar, trail)
+        trail = Trail()
+        status = propagator(csp, newVar, trail)
+        return status, trail.get_prunings()
+
+    wrapper.uses_trail = True
+    return wrapper
+
+########################################################
+# Search listeners                                     #
+########################################################
+
+class SearchListener:
+    '''Base class for objects told of the events of a BT search (see
+       BT.add_listener). Every method does nothing; subclasses override
+       the ones they need. level is the depth of the decision (1 for the
+       first variable assigned, 0 for the root propagation).'''
+
+    def search_started(self, solver):
+        '''A new search of solver (a BT object) is starting'''
+
+    def selected(self, var, level, seconds):
+        '''var was picked to be assigned next, taking seconds'''
+
+    def assigned(self, var, val, level):
+        '''var was assigned val'''
+
+    def propagated(self, var, level, status, mark, seconds):
+        '''The propagator ran after var was assigned (var is None at the
+           root), taking seconds and returning status. Its prunings are
+           those on the solver's trail since mark.'''
+
+    def revised(self, constraint, n_pruned):
+        '''A propagator revised constraint, finding n_pruned values
+           without support'''
+
+    def undone(self, var, level, mark):
+        '''The value of var is being undone along with the prunings on
+           the solver's trail since mark'''
+
+    def backtracked(self, var, level):
+        '''Every value of var has been tried'''
+
+    def search_stopped(self, status):
+        '''search_resume returned status'''
+
+class SearchStats(SearchListener):
+    '''Listener collecting statistics of the searches it listens to:
+       decisions and backtracks at each level, the time spent choosing
+       variables and propagating, and the revisions and prunings of each
+       constraint (by name). The statistics add up over searches until
+       clear is called, and are exported by to_dict and to_json.'''
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        '''Reset all statistics'''
+        self.solver = None
+        self.searches = 0
+        self.solutions = 0
+        self.nodes = []             #nodes[k]: assignments made at level k+1
+        self.backtracks = []        #backtracks[k]: times level k+1 ran out of values
+        self.failures = 0           #propagations finding a dead end
+        self.prunings = 0
+        self.select_time = 0
+        self.propagate_time = 0
+        self.revisions = dict()     #constraint name -> times revised
+        self.constraint_prunings = dict()   #constraint name -> values found unsupported
+
+    def search_started(self, solver):
+        self.solver = solver
+        self.searches = self.searches + 1
+
+    def selected(self, var, level, seconds):
+        self.select_time = self.select_time + seconds
+
+    def assigned(self, var, val, level):
+        while len(self.nodes) < level:
+            self.nodes.append(0)
+        self.nodes[level - 1] = self.nodes[level - 1] + 1
+
+    def propagated(self, var, level, status, mark, seconds):
+        self.propagate_time = self.propagate_time + seconds
+        self.prunings = self.prunings + len(self.solver.trail) - mark
+        if not status:
+            self.failures = self.failures + 1
+
+    def revised(self, constraint, n_pruned):
+        name = constraint.name
+        self.revisions[name] = self.revisions.get(name, 0) + 1
+        self.constraint_prunings[name] = self.constraint_prunings.get(name, 0) + n_pruned
+
+    def backtracked(self, var, level):
+        while len(self.backtracks) < level:
+            self.backtracks.append(0)
+        self.backtracks[level - 1] = self.backtracks[level - 1] + 1
+
+    def search_stopped(self, status):
+        if status == True:
+            self.solutions = self.solutions + 1
+
+    def to_dict(self):
+        '''Return the statistics as a dict of numbers, lists and dicts'''
+        return {"searches": self.searches,
+                "solutions": self.solutions,
+                "decisions": sum(self.nodes),
+                "nodes_per_level": list(self.nodes),
+                "backtracks": sum(self.backtracks),
+                "backtracks_per_level": list(self.backtracks),
+                "failures": self.failures,
+                "prunings": self.prunings,
+                "select_time": self.select_time,
+                "propagate_time": self.propagate_time,
+                "revisions": dict(self.revisions),
+                "constraint_prunings": dict(self.constraint_prunings)}
+
+    def to_json(self, indent=None):
+        '''Return the statistics (see to_dict) as a JSON string'''
+        return json.dumps(self.to_dict(), indent=indent)
+
+class SearchTracer(SearchListener):
+    '''Listener printing a trace of the search (see BT.trace_on)'''
+
+    def search_started(self, solver):
+        self.solver = solver
+        print(len(solver.unasgn_vars), " unassigned variables at start of search")
+
+    def selected(self, var, level, seconds):
+        print('  ' * (level - 1), "bt_search var = ", var)
+
+    def assigned(self, var, val, level):
+        print('  ' * level, "bt_search trying", var, "=", val)
+
+    def propagated(self, var, level, status, mark, seconds):
+        if var is None:
+            print("Root Prunings: ", self.solver.trail.get_prunings(mark))
+            return
+        print('  ' * level, "bt_search prop status = ", status)
+        print('  ' * level, "bt_search prop pruned = ", self.solver.trail.get_prunings(mark))
+
+    def undone(self, var, level, mark):
+        print('  ' * level, "bt_search restoring ", self.solver.trail.get_prunings(mark))
+
 ########################################################
 # Backtracking Routine                                 #
 ########################################################
 
+#Default number of nogoods kept by a backjumping search (see BT.cbj_on)
+NOGOOD_STORE_SIZE = 10000
+
+#With random tie-breaking, the number of variables of the smallest MRV
+#bucket the next variable is drawn from (see BT.set_random_ties)
+MRV_TIE_SAMPLE = 16
+
+#Default number of decisions of the unit run of search_restarts
+RESTART_RUN_NODES = 100
+
+#Default number of decisions between two calls of a stop function (see
+#BT.resume_slices)
+SLICE_NODES = 1000
+
+def luby(i):
+    '''Return the i-th term (from 1) of the Luby sequence
+       1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8, ...'''
+    k = 1
+    while (1 << k) - 1 < i:
+        k = k + 1
+    while True:
+        if i == (1 << k) - 1:
+            return 1 << (k - 1)
+        i = i - (1 << (k - 1)) + 1
+        k = 1
+        while (1 << k) - 1 < i:
+            k = k + 1
+
+class SearchResult:
+    '''The outcome of a search (see BT.solve).
+         status  True if a solution was found, False if there is none,
+                 None if the search ran out of budget
+         values  the solution as a snapshot (bytes, see BT.get_snapshot),
+                 None if there is no solution
+         stats   dict of the search statistics (see BT.get_stats)'''
+
+    def __init__(self, status, values, stats):
+        self.status = status
+        self.values = values
+        self.stats = stats
+
+    def __repr__(self):
+        return "{}(status={}, stats={})".format(type(self).__name__, self.status, self.stats)
+
 class BT:
     '''use a class to encapsulate things like statistics
        and bookeeping for pruning/unpruning variabel domains
@@ -380,25 +1273,101 @@ class BT:
         self.nDecisions = 0 #nDecisions is the number of variable 
                             #assignments made during search
         self.nPrunings  = 0 #nPrunings is the number of value prunings during search
-        unasgn_vars = list() #used to track unassigned variables
-        self.TRACE = False
+        self.trail = Trail() #prunings made during search, for undoing them
+        self.unasgn_vars = dict() #used to track unassigned variables, maps
+                                  #each to its current domain size
+        self.mrv_buckets = []     #bucket queue, mrv_buckets[k] holds the
+                                  #unassigned variables with domain size k
+        self.listeners = [] #SearchListener objects told of search events
         self.runtime = 0
+        self.propagator = None #state of the current search, see search_start
+        self.stack = []
+        self.descend = True
+        self.status = False
+        self.cbj = False        #conflict-directed backjumping, see cbj_on
+        self.nogoods = None     #NogoodStore of learned nogoods, None if not learning
+        self.learning = True    #False once a solution is found (see search_resume)
+        self.nBackjumps = 0     #backtracks that skipped over some levels
+        self.nRestarts = 0      #restarts made by search_restarts
+        self.value_order = None #function ordering the values to try, see set_value_order
+        self.rng = None         #random.Random breaking MRV ties, see set_random_ties
+        self.components = None  #components left by a paused search_components
+
+    def set_value_order(self, order):
+        '''Set the order in which the values of each variable are tried.
+           order is a function order(csp, var) returning the values of
+           var's current domain in the order to try them (e.g., those of
+           the heuristics module), or None for the current domain's own
+           order.'''
+        self.value_order = order
+
+    def set_random_ties(self, seed=None):
+        '''Break ties between the variables with the fewest values left
+           at random, drawing from a random.Random seeded with seed. The
+           variables start in a random order and each pick is drawn from
+           (up to MRV_TIE_SAMPLE of) the smallest MRV bucket. Call with
+           seed False to go back to deterministic picks.'''
+        if seed is False:
+            self.rng = None
+        else:
+            self.rng = random.Random(seed)
+
+    def cbj_on(self, max_nogoods=NOGOOD_STORE_SIZE):
+        '''Turn conflict-directed backjumping on. The propagators' prunings
+           are then explained (see ExplainingTrail); when every value of a
+           variable has failed, search jumps straight back to the deepest
+           decision in the conflict set behind the failures rather than to
+           the previous one. The decisions of each conflict set are also
+           learned as a nogood, up to max_nogoods of them (0 to learn
+           none), and a nogood all but one of whose decisions hold prunes
+           the value of the last. Nogoods are kept across searches of the
+           same CSP.'''
+        self.cbj = True
+        self.nogoods = None
+        if max_nogoods:
+            self.nogoods = NogoodStore(max_nogoods)
+
+    def cbj_off(self):
+        '''Turn conflict-directed backjumping off, forgetting the nogoods'''
+        self.cbj = False
+        self.nogoods = None
+
+    def add_listener(self, listener):
+        '''Have listener (a SearchListener) told of the events of the
+           searches of this solver. With no listeners the search does no
+           timing or reporting work at all.'''
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        '''Stop telling listener of search events'''
+        self.listeners.remove(listener)
 
     def trace_on(self):
         '''Turn search trace on'''
-        self.TRACE = True
+        if not any(isinstance(l, SearchTracer) for l in self.listeners):
+            self.add_listener(SearchTracer())
 
     def trace_off(self):
         '''Turn search trace off'''
-        self.TRACE = False
+        self.listeners[:] = [l for l in self.listeners if not isinstance(l, SearchTracer)]
 
         
     def clear_stats(self):
         '''Initialize counters'''
         self.nDecisions = 0
         self.nPrunings = 0
+        self.nBackjumps = 0
+        self.nRestarts = 0
         self.runtime = 0
 
+    def get_stats(self):
+        '''Return the statistics of the last search as a dict'''
+        return {"decisions": self.nDecisions,
+                "prunings": self.nPrunings,
+                "backjumps": self.nBackjumps,
+                "restarts": self.nRestarts,
+                "runtime": self.runtime}
+
     def print_stats(self):
         print("Search made {} variable assignments and pruned {} variable values".format(
             self.nDecisions, self.nPrunings))
@@ -408,6 +1377,59 @@ class BT:
            each item in prunings is a pair (var, val)'''
         for var, val in prunings:
             var.unprune_value(val)
+            self.updateMRVvar(var)
+
+    def propagate(self, propagator, var=None):
+        '''Run propagator after var has been assigned (or at the root if
+           var is None), with its prunings going onto the trail. Returns
+           the propagator's status. Propagators that do not use the trail
+           return their prunings, which are then recorded on it.'''
+        mark = len(self.trail)
+        if getattr(propagator, 'uses_trail', False):
+            status = propagator(self.csp, var, self.trail)
+        else:
+            status, prunings = propagator(self.csp, var)
+            for pvar, val in prunings:
+                self.trail.record(pvar, val)
+        self.nPrunings = self.nPrunings + len(self.trail) - mark
+        pruned = self.trail.vars
+        for i in range(mark, len(pruned)):
+            self.updateMRVvar(pruned[i])
+        return status
+
+    def propagate_nogoods(self, var, val):
+        '''Check the learned nogoods containing the decision var = val.
+           Returns False (reporting the conflict on the trail) if one has
+           all its decisions made; prunes the value of a nogood's last
+           decision if all the others are made.'''
+        trail = self.trail
+        for nogood in self.nogoods.get(var, val):
+            free = None
+            reason = 0
+            for w, a in nogood:
+                if w.is_assigned():
+                    if w.get_assigned_value() != a:
+                        break
+                    reason |= 1 << trail.level[w]
+                elif free is None and w.in_cur_domain(a):
+                    free = (w, a)
+                else:
+                    break
+            else:
+                if free is None:
+                    trail.conflict = reason
+                    return False
+                trail.prune_because(free[0], free[1], reason)
+                self.nPrunings = self.nPrunings + 1
+                self.updateMRVvar(free[0])
+                if free[0].cur_domain_size() == 0:
+                    return False
+        return True
+
+    def undo(self, mark):
+        '''Restore all values pruned since mark was taken on the trail'''
+        while len(self.trail) > mark:
+            self.updateMRVvar(self.trail.pop())
 
     def restore_all_variable_domains(self):
         '''Reinitialize all variable domains'''
@@ -416,35 +1438,65 @@ class BT:
                 var.unassign()
             var.restore_curdom()
 
+    def initMRV(self):
+        '''Put all unassigned variables of the CSP into the MRV bucket
+           queue, keyed by their current domain size'''
+        self.unasgn_vars = dict()
+        self.mrv_buckets = [dict()]
+        vars = self.csp.vars
+        if self.rng is not None:
+            vars = list(vars)
+            self.rng.shuffle(vars)
+        for v in vars:
+            if not v.is_assigned():
+                self.restoreUnasgnVar(v)
+
+    def updateMRVvar(self, var):
+        '''Move var, whose domain has just changed, to its new bucket
+           (if it is unassigned)'''
+        old = self.unasgn_vars.get(var)
+        if old is not None:
+            new = var.cur_domain_size()
+            if old != new:
+                del self.mrv_buckets[old][var]
+                self.mrv_buckets[new][var] = True
+                self.unasgn_vars[var] = new
+
     def extractMRVvar(self):
-        '''Remove variable with minimum sized cur domain from list of
-           unassigned vars. Would be faster to use heap...but this is
-           not production code.
+        '''Remove variable with minimum sized cur domain from the
+           unassigned vars. The buckets are indexed by domain size so
+           this only looks at the (few) possible sizes.
         '''
-
-        md = -1
-        mv = None
-        for v in self.unasgn_vars:
-            if md < 0:
-                md = v.cur_domain_size()
-                mv = v
-            elif v.cur_domain_size() < md:
-                md = v.cur_domain_size()
-                mv = v
-        self.unasgn_vars.remove(mv)
-        return mv
+        for bucket in self.mrv_buckets:
+            if bucket:
+                if self.rng is None:
+                    mv, _ = bucket.popitem()
+                else:
+                    mv = self.rng.choice(list(itertools.islice(bucket, MRV_TIE_SAMPLE)))
+                    del bucket[mv]
+                del self.unasgn_vars[mv]
+                return mv
+        return None
 
     def restoreUnasgnVar(self, var):
-        '''Add variable back to list of unassigned vars'''
-        self.unasgn_vars.append(var)
+        '''Add variable back to the unassigned vars'''
+        size = var.cur_domain_size()
+        while len(self.mrv_buckets) <= size:
+            self.mrv_buckets.append(dict())
+        self.mrv_buckets[size][var] = True
+        self.unasgn_vars[var] = size
         
-    def bt_search(self,propagator):
+    def bt_search(self, propagator, max_nodes=None, max_time=None):
         '''Try to solve the CSP using specified propagator routine
 
            propagator == a function with the following template
            propagator(csp, newly_instantiated_variable=None)
            ==> returns (True/False, [(Variable, Value), (Variable, Value) ...]
 
+           or a propagator decorated with trail_propagator, which is
+           instead handed the search's Trail and pushes its prunings
+           onto it (see propagate).
+
            csp is a CSP object---the propagator can use this to get access
            to the variables and constraints of the problem.
 
@@ -468,82 +1520,468 @@ class BT:
            values when it undoes a variable assignment.
 
            NOTE propagator SHOULD NOT prune a value that has already been 
-           pruned! Nor should it prune a value twice'''
-
-        self.clear_stats()
-        stime = time.process_time()
+           pruned! Nor should it prune a value twice
 
-        self.restore_all_variable_domains()
-        
-        self.unasgn_vars = []
-        for v in self.csp.vars:
-            if not v.is_assigned():
-                self.unasgn_vars.append(v)
+           max_nodes and max_time optionally bound the search (see
+           search_resume). If the budget runs out the search is left
+           paused with its partial assignment in place and can be
+           continued with search_resume. Returns True/False/None as
+           search_resume does.
 
-        status, prunings = propagator(self.csp) #initial propagate no assigned variables.
-        self.nPrunings = self.nPrunings + len(prunings)
+           The progress, solution and statistics are printed; solve
+           does the same search without printing.'''
 
-        if self.TRACE:
-            print(len(self.unasgn_vars), " unassigned variables at start of search")
-            print("Root Prunings: ", prunings)
+        return self.solve(propagator, max_nodes, max_time, verbose=True).status
 
-        if status == False:
-            print("CSP{} detected contradiction at root".format(
-                self.csp.name))
-        else:
-            status = self.bt_recurse(propagator, 1)   #now do recursive search
+    def solve(self, propagator, max_nodes=None, max_time=None, verbose=False):
+        '''Search for a solution as bt_search does, but return a
+           SearchResult with the status, the solution as a snapshot (see
+           get_snapshot) and the statistics of the search. Nothing is
+           printed unless verbose is True.
 
+           If the search finished it is ended (see end_search), leaving
+           the solution, if any, assigned. If the budget ran out it is
+           left paused and can be continued with search_resume.'''
 
-        self.restoreValues(prunings)
-        if status == False:
-            print("CSP{} unsolved. Has no solutions".format(self.csp.name))
+        stime = time.process_time()
+        self.search_start(propagator)
+        if verbose and self.status == False:
+            print("CSP{} detected contradiction at root".format(self.csp.name))
+        status = self.search_resume(max_nodes, max_time)
+
+        if status is None:
+            if verbose:
+                print("CSP {} search stopped after {} decisions, {} variables assigned".format(
+                    self.csp.name, self.nDecisions, len(self.get_decisions())))
+                self.print_stats()
+            return SearchResult(status, None, self.get_stats())
+
+        self.end_search()
+        values = None
         if status == True:
-            print("CSP {} solved. CPU Time used = {}".format(self.csp.name,
-                                                             time.process_time() - stime))
-            self.csp.print_soln()
-
-        print("bt_search finished")
-        self.print_stats()
-
-    def bt_recurse(self, propagator, level):
-        '''Return true if found solution. False if still need to search.
-           If top level returns false--> no solution'''
+            values = self.get_snapshot()
+        if verbose:
+            if status == False:
+                print("CSP{} unsolved. Has no solutions".format(self.csp.name))
+            if status == True:
+                print("CSP {} solved. CPU Time used = {}".format(self.csp.name,
+                                                                 time.process_time() - stime))
+                self.csp.print_soln()
+
+            print("bt_search finished")
+            self.print_stats()
+        return SearchResult(status, values, self.get_stats())
+
+    def search(self, propagator, max_nodes=None, max_time=None):
+        '''Start a new search with propagator and run it (see
+           search_start and search_resume). Prints nothing.'''
+        self.search_start(propagator)
+        return self.search_resume(max_nodes, max_time)
+
+    def search_start(self, propagator):
+        '''Set up a new search: clear all assignments and prunings, and
+           do the initial propagation. The search itself is then run by
+           search_resume.'''
+        self.clear_stats()
+        stime = time.process_time()
 
-        if self.TRACE:
-            print('  ' * level, "bt_recurse level ", level)
-           
-        if not self.unasgn_vars:
-            #all variables assigned
-            return True
+        self.restore_all_variable_domains()
+        
+        self.initMRV()
+        if self.cbj:
+            self.trail = ExplainingTrail(self.listeners)
         else:
-            var = self.extractMRVvar()
-            if self.TRACE:
-                print('  ' * level, "bt_recurse var = ", var)
-
-            for val in var.cur_domain():
-
-                if self.TRACE:
-                    print('  ' * level, "bt_recurse trying", var, "=", val)
-
-                var.assign(val)
-                self.nDecisions = self.nDecisions+1
-
-                status, prunings = propagator(self.csp, var)
-                self.nPrunings = self.nPrunings + len(prunings)
-
-                if self.TRACE:
-                    print('  ' * level, "bt_recurse prop status = ", status)
-                    print('  ' * level, "bt_recurse prop pruned = ", prunings)
-
-                if status:
-                    if self.bt_recurse(propagator, level+1):
-                        return True
+            self.trail = Trail(self.listeners)
+        self.learning = True
+        self.propagator = propagator
+        self.stack = []     #decision stack, one frame per assigned variable
+        self.descend = True #next step is to pick a new variable
+        self.components = None
+
+        listeners = self.listeners
+        if listeners:
+            for l in listeners:
+                l.search_started(self)
+            t = time.perf_counter()
+        status = self.propagate(propagator) #initial propagate no assigned variables.
+        if listeners:
+            t = time.perf_counter() - t
+            for l in listeners:
+                l.propagated(None, 0, status, 0, t)
 
-                if self.TRACE:
-                    print('  ' * level, "bt_recurse restoring ", prunings)
-                self.restoreValues(prunings)
-                var.unassign()
-
-            self.restoreUnasgnVar(var)
+        if status == False:
+            self.status = False
+        else:
+            self.status = None
+        self.runtime = self.runtime + time.process_time() - stime
+
+    def search_resume(self, max_nodes=None, max_time=None):
+        '''Run (or continue) the search set up by search_start.
+
+           The search keeps its own stack of decisions rather than
+           recursing, so the number of variables is not limited by the
+           recursion limit. Each frame of the stack is a list
+           [var, values, next, mark, conflict]: the values of var's
+           domain to try, the index of the next one, the trail mark taken
+           before the value being tried was assigned (None if none is),
+           and with backjumping (see cbj_on) the levels, as a bitmask, of
+           the decisions found to be behind the failures of var's values.
+
+           Returns
+             True  if a solution was found. The solution is left
+                   assigned; resuming again rejects it and continues
+                   to the next solution.
+             False if there are no (more) solutions.
+             None  if max_nodes decisions were made or max_time seconds
+                   of CPU time used in this call before finishing. The
+                   partial assignment (see get_decisions) is left in
+                   place and resuming continues where it stopped.
+
+           A search_components run stopped by its budget is continued
+           the same way (see resume_components).'''
+
+        if self.components:
+            return self.resume_components(max_nodes, max_time)
+        if self.status == False:
             return False
-
+        stime = time.process_time()
+        nodes = 0
+        stack = self.stack
+        listeners = self.listeners
+        cbj = self.cbj
+        trail = self.trail
+        jump_to = None  #level being jumped back to, None if not jumping
+
+        if self.status == True:
+            #resume after a solution: reject it and backtrack
+            self.descend = False
+            if cbj:
+                #rejecting a solution is no conflict: backtrack chronologically
+                #over the decisions leading to it, and learn no more nogoods
+                for level in range(1, len(stack) + 1):
+                    stack[level - 1][4] |= (1 << level) - 1
+                self.learning = False
+        descend = self.descend
+
+        while True:
+            if descend:
+                if not self.unasgn_vars:
+                    #all variables assigned
+                    self.status = True
+                    break
+                if listeners:
+                    t = time.perf_counter()
+                var = self.extractMRVvar()
+                if listeners:
+                    t = time.perf_counter() - t
+                    for l in listeners:
+                        l.selected(var, len(stack) + 1, t)
+                conflict = 0
+                if cbj:
+                    #the values already pruned from var count against it
+                    conflict = trail.var_reason.get(var, 0)
+                if self.value_order is None:
+                    values = var.cur_domain()
+                else:
+                    values = self.value_order(self.csp, var)
+                stack.append([var, values, 0, None, conflict])
+                descend = False
+
+            if not stack:
+                self.status = False
+                break
+
+            frame = stack[-1]
+            var = frame[0]
+            level = len(stack)
+            if frame[3] is not None:
+                #undo the value last tried
+                if listeners:
+                    for l in listeners:
+                        l.undone(var, level, frame[3])
+                self.undo(frame[3])
+                var.unassign()
+                frame[3] = None
+                if cbj:
+                    del trail.level[var]
+                    trail.depth = level - 1
+
+            if jump_to is not None and level <= jump_to:
+                jump_to = None
+            if frame[2] == len(frame[1]) or jump_to is not None:
+                #all values tried (or jumping back over this level), backtrack
+                stack.pop()
+                self.restoreUnasgnVar(var)
+                if listeners:
+                    for l in listeners:
+                        l.backtracked(var, level)
+                if cbj and jump_to is None:
+                    #jump back to the deepest decision in the conflict set,
+                    #level 0 (the root) if there is none: no more solutions
+                    conflict = frame[4]
+                    jump_to = max(conflict.bit_length() - 1, 0)
+                    if jump_to < level - 1:
+                        self.nBackjumps = self.nBackjumps + 1
+                    if jump_to > 0:
+                        stack[jump_to - 1][4] |= conflict & ~(1 << jump_to)
+                        if self.learning and self.nogoods is not None:
+                            self.nogoods.add(self.get_conflict_decisions(conflict))
+                continue
+
+            if (max_nodes is not None and nodes >= max_nodes) or \
+               (max_time is not None and time.process_time() - stime >= max_time):
+                self.status = None
+                break
+
+            val = frame[1][frame[2]]
+            frame[2] = frame[2] + 1
+
+            frame[3] = self.trail.mark()
+            var.assign(val)
+            self.nDecisions = self.nDecisions+1
+            nodes = nodes + 1
+            if cbj:
+                trail.level[var] = level
+                trail.depth = level
+
+            if listeners:
+                for l in listeners:
+                    l.assigned(var, val, level)
+                t = time.perf_counter()
+            descend = self.propagate(self.propagator, var)
+            if descend and self.nogoods:
+                descend = self.propagate_nogoods(var, val)
+            if cbj and not descend:
+                frame[4] |= trail.get_conflict(frame[3]) & ~(1 << level)
+            if listeners:
+                t = time.perf_counter() - t
+                for l in listeners:
+                    l.propagated(var, level, descend, frame[3], t)
+
+        self.descend = descend
+        self.runtime = self.runtime + time.process_time() - stime
+        if listeners:
+            for l in listeners:
+                l.search_stopped(self.status)
+        return self.status
+
+    def resume_slices(self, max_nodes=None, max_time=None, stop=None, slice_nodes=SLICE_NODES):
+        '''Continue the search as search_resume does, but slice_nodes
+           decisions at a time, calling stop() between the slices: once
+           it returns True the search is left paused and None returned
+           (e.g. to cancel a search from another thread or process).
+           Without stop this is search_resume.'''
+        if stop is None:
+            return self.search_resume(max_nodes, max_time)
+        stime = time.process_time()
+        start = self.nDecisions
+        while not stop():
+            nodes = slice_nodes
+            if max_nodes is not None:
+                if self.nDecisions - start >= max_nodes:
+                    return None
+                nodes = min(nodes, max_nodes - (self.nDecisions - start))
+            secs = None
+            if max_time is not None:
+                secs = max_time - (time.process_time() - stime)
+                if secs <= 0:
+                    return None
+            status = self.search_resume(nodes, secs)
+            if status is not None:
+                return status
+        return None
+
+    def search_restarts(self, propagator, run_nodes=RESTART_RUN_NODES, max_nodes=None,
+                        max_time=None, stop=None, slice_nodes=SLICE_NODES):
+        '''Search with restarts: the i-th run is cut off after run_nodes
+           times luby(i) decisions beyond the one decision per
+           unassigned variable a search without backtracking makes, and
+           the search then starts over. Runs differ through random
+           tie-breaking (see set_random_ties) and the nogoods learned by
+           backjumping (see cbj_on), which are kept from run to run, so
+           a run stuck in a bad subtree is abandoned early rather than
+           searched to the end.
+
+           max_nodes and max_time bound all the runs together. Returns
+           True/False as search does, or None if the budget ran out (the
+           last run is then left paused). With a stop function the runs
+           are made in slices, and the search stops as resume_slices
+           does. The statistics add up all the runs, with nRestarts
+           counting the restarts made.'''
+        stime = time.process_time()
+        decisions = 0
+        prunings = 0
+        backjumps = 0
+        n_vars = sum(1 for v in self.csp.vars if not v.is_assigned())
+        i = 1
+        while True:
+            nodes = n_vars + run_nodes * luby(i)
+            if max_nodes is not None:
+                nodes = min(nodes, max_nodes - decisions)
+            secs = None
+            if max_time is not None:
+                secs = max_time - (time.process_time() - stime)
+            self.search_start(propagator)
+            status = self.resume_slices(nodes, secs, stop, slice_nodes)
+            decisions = decisions + self.nDecisions
+            prunings = prunings + self.nPrunings
+            backjumps = backjumps + self.nBackjumps
+            if status is not None:
+                break
+            if (max_nodes is not None and decisions >= max_nodes) or \
+               (max_time is not None and time.process_time() - stime >= max_time) or \
+               (stop is not None and stop()):
+                break
+            self.end_search()
+            i = i + 1
+
+        self.nDecisions = decisions
+        self.nPrunings = prunings
+        self.nBackjumps = backjumps
+        self.nRestarts = i - 1
+        self.runtime = time.process_time() - stime
+        return status
+
+    def search_components(self, propagator, max_nodes=None, max_time=None):
+        '''Solve the CSP by splitting it into its connected components
+           (see CSP.get_components) and searching each one separately, so
+           a failure in one component never backtracks over decisions made
+           in another. Variables not in any constraint are grouped into a
+           single component. Since the component CSPs share the variable
+           objects, their solutions end up assigned in the CSP's variables
+           (and hence in e.g. the minesweeper variable_array).
+
+           The statistics of the component searches are added up. The
+           budgets apply to the whole run. Returns True if every
+           component was solved, False if one has no solution and None
+           if the budget ran out. After None the component being searched
+           is left paused, with its partial assignment, and search_resume
+           continues the run (see resume_components).'''
+        self.clear_stats()
+        self.restore_all_variable_domains()
+        self.trail = Trail(self.listeners)
+        self.stack = []
+
+        components = []
+        free = []
+        for component in self.csp.get_components():
+            if len(component) == 1 and not self.csp.vars_to_cons[component[0]]:
+                free.append(component[0])
+            else:
+                components.append(component)
+        if free:
+            components.append(free)
+
+        self.propagator = propagator
+        self.components = [(i, component) for i, component in enumerate(components)]
+        return self.resume_components(max_nodes, max_time)
+
+    def resume_components(self, max_nodes=None, max_time=None):
+        '''Continue a search_components run: resume the paused component
+           search, if any, then search the components left, within
+           max_nodes decisions and max_time seconds for this call.
+           Returns as search_components does. Once the run has finished
+           (True or False) there is nothing left to resume, and
+           search_resume returns False.'''
+        stime = time.process_time()
+        decisions = 0
+        status = True
+        while self.components:
+            sub = self.components[0]
+            nodes = None
+            if max_nodes is not None:
+                nodes = max_nodes - decisions
+            secs = None
+            if max_time is not None:
+                secs = max_time - (time.process_time() - stime)
+            if isinstance(sub, BT):
+                before = (sub.nDecisions, sub.nPrunings, sub.nBackjumps)
+                status = sub.search_resume(nodes, secs)
+            else:
+                i, component = sub
+                sub = BT(self.csp.get_sub_csp("{}-{}".format(self.csp.name, i), component))
+                sub.listeners = self.listeners
+                sub.cbj = self.cbj
+                sub.nogoods = self.nogoods
+                sub.value_order = self.value_order
+                sub.rng = self.rng
+                before = (0, 0, 0)
+                status = sub.search(self.propagator, nodes, secs)
+            decisions = decisions + sub.nDecisions - before[0]
+            self.nDecisions = self.nDecisions + sub.nDecisions - before[0]
+            self.nPrunings = self.nPrunings + sub.nPrunings - before[1]
+            self.nBackjumps = self.nBackjumps + sub.nBackjumps - before[2]
+            if status is None:
+                self.components[0] = sub
+                break
+            sub.end_search()
+            if status == False:
+                self.components = None
+                break
+            self.components.pop(0)
+
+        if status is not None:
+            self.components = None
+        self.status = None if status is None else False
+        self.runtime = self.runtime + time.process_time() - stime
+        return status
+
+    def get_decisions(self):
+        '''Return list of the (Variable, value) decisions currently made
+           by the search, from the root down'''
+        decisions = []
+        for var, vals, i, mark, conflict in self.stack:
+            if mark is not None:
+                decisions.append((var, vals[i - 1]))
+        return decisions
+
+    def get_conflict_decisions(self, conflict):
+        '''Return list of the (Variable, value) decisions at the levels
+           (other than the root) in the bitmask conflict'''
+        decisions = []
+        for level in range(1, conflict.bit_length()):
+            if conflict >> level & 1:
+                var, vals, i, mark, c = self.stack[level - 1]
+                decisions.append((var, vals[i - 1]))
+        return decisions
+
+    def end_search(self):
+        '''Finish with the current search: undo all prunings (including
+           those made at the root) and forget the decision stack. The
+           variables keep their assignments, e.g., the solution found.'''
+        if self.components:
+            if isinstance(self.components[0], BT):
+                self.components[0].end_search()
+            self.components = None
+        self.undo(0)
+        self.stack = []
+        self.status = False
+
+    def iter_solutions(self, propagator, limit=None):
+        '''Generate the solutions of the CSP one at a time (at most limit
+           of them, all if limit is None), resuming the search after each
+           one. Each solution is yielded as a snapshot (see get_snapshot),
+           and none are kept by the search, so any number of solutions can
+           be streamed in the memory of a single search. The search is
+           ended (see end_search) once the generator finishes or is closed.'''
+        self.search_start(propagator)
+        n = 0
+        try:
+            while limit is None or n < limit:
+                if self.search_resume() != True:
+                    break
+                n = n + 1
+                yield self.get_snapshot()
+        finally:
+            self.end_search()
+
+    def get_snapshot(self):
+        '''Return the current (full) assignment as an immutable bytes
+           object: the index in its domain of each variable's value, in
+           the order of the CSP's variables. Domains must have at most 256
+           values.'''
+        return bytes([var.value_index(var.get_assigned_value()) for var in self.csp.vars])
+
+    def decode_snapshot(self, snapshot):
+        '''Return list of the (Variable, value) pairs of a snapshot'''
+        return [(var, var.domain()[i]) for var, i in zip(self.csp.vars, snapshot)]
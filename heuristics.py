@@ -0,0 +1,52 @@
+'''Value ordering heuristics for BT (see BT.set_value_order).
+
+   A value ordering is a function with the template
+      order(csp, var) ==> returns the values of var's current domain
+
+   It is called when the search selects the (unassigned) variable var,
+   and the search tries var's values in the order returned. Leaving the
+   ordering unset tries them in the current domain's order, which for a
+   minesweeper cell is always the blank before the mine.
+
+   Constraints with incremental counters (TotalCountConstraint) span the
+   whole problem and are left out of the estimates below: they say
+   little about any one variable and are costly to query.
+'''
+
+def val_lcv(csp, var):
+    '''Least constraining value first: each value is tried out (var is
+       assigned it) and scored by the number of values of the other
+       variables it leaves without support in var's constraints. Values
+       that leave the most options open are tried first; ties keep the
+       domain order.'''
+    constraints = [c for c in csp.get_cons_with_var(var) if not c.incremental]
+    scores = []
+    for val in var.cur_domain():
+        var.assign(val)
+        n = 0
+        for c in constraints:
+            n = n + len(c.get_unsupported())
+        var.unassign()
+        scores.append(n)
+    order = sorted(range(len(scores)), key=lambda i: scores[i])
+    dom = var.cur_domain()
+    return [dom[i] for i in order]
+
+def val_probability(csp, var):
+    '''Most probable value first: the probability of each value is
+       estimated as the product, over var's constraints, of the fraction
+       of the constraint's ways of being satisfied (count_support) that
+       give var the value. On a minesweeper board this tries the blank
+       first around clues that make a mine unlikely and the mine first
+       where the clues make one likely. Ties keep the domain order.'''
+    dom = var.cur_domain()
+    scores = [1.0] * len(dom)
+    for c in csp.get_cons_with_var(var):
+        if c.incremental:
+            continue
+        ways = [c.count_support(var, val) for val in dom]
+        total = sum(ways)
+        if total:
+            scores = [s * w / total for s, w in zip(scores, ways)]
+    order = sorted(range(len(dom)), key=lambda i: -scores[i])
+    return [dom[i] for i in order]
@@ -1,48 +1,112 @@
+import itertools
 import random
+from minesweeper_csp import neighbour_index, nest_cells
 
-def mine_board_generator_2d(width, height):
-    mine_field = [[" " for i in range(height)] for i in range(width)]
-    for i in range(0, width):
-        for j in range(0, height):
-            # generate a random number here, and have a chance for the board to be set to "*"
-            if (random.randint(0,5) == 0):
-                mine_field[i][j] = "*"
-
-    mine_board = [[0 for i in range(height)] for i in range(width)]
-    for i in range(0, width):
-        for j in range(0, height):
-            if mine_field[i][j] != "*":
-                for k in range(-1, 2):
-                    for l in range(-1, 2):
-                        if 0 <= i + k < width and 0 <= j + l < height:
-                            if mine_field[i + k][j + l] == "*":
-                                mine_board[i][j] += 1
-                mine_field[i][j] = mine_board[i][j]
-                if mine_field[i][j] == 0:
-                    mine_field[i][j] = " "
-
-    return mine_board, mine_field
-
-def mine_board_generator_3d(width, height, depth):
-    mine_field = [[[" " for i in range(depth)] for i in range(height)] for i in range(width)]
-    for i in range(0, width):
-        for j in range(0, height):
-            for k in range(0,depth):
-                # generate a random number here, and have a chance for the board to be set to "*"
-                if (random.randint(0,5) == 0):
-                    mine_field[i][j][k] = "*"
-
-    mine_board = [[[0 for i in range(depth)] for i in range(height)] for i in range(width)]
-    for i in range(0, width):
-        for j in range(0, height):
-            for k in range(0,depth):
-                if mine_field[i][j][k] != "*":
-                    for x in range(-1, 2):
-                        for y in range(-1, 2):
-                            for z in range(-1, 2):
-                                if 0 <= i + x < width and 0 <= j + y < height and 0 <= k + z < depth:
-                                    if mine_field[i + x][j + y][k + z] == "*":
-                                        mine_board[i][j][k] += 1
-                    mine_field[i][j][k] = mine_board[i][j][k]
-
-    return mine_board, mine_field
+try:
+    import numpy
+except ImportError:   # numpy is only needed by the *_np generators
+    numpy = None
+
+def random_source(seed):
+    '''Return a random.Random seeded with seed, or the random module
+       itself (the global generator) if seed is None'''
+    if seed is None:
+        return random
+    return random.Random(seed)
+
+def is_mine(rng, density):
+    '''Draw whether a cell holds a mine: with probability density, or
+       1 in 6 if density is None'''
+    if density is None:
+        return rng.randint(0,5) == 0
+    return rng.random() < density
+
+def mine_board_generator(shape, density=None, seed=None, blank=" "):
+    '''
+    Return (mine_board, mine_field) for a random board of any shape (a
+    tuple of sizes). Each cell is a mine with probability density (1 in
+    6 if None), drawn in row-major order from a generator seeded with
+    seed, or from the global random module if seed is None. mine_board
+    holds the clues (0 for mines and cells with no mine around), and
+    mine_field the solution: "*" for a mine, otherwise the clue, shown as
+    blank when 0. The clues are counted over the cells' neighbours as
+    listed by minesweeper_csp.neighbour_index.
+    '''
+    shape = tuple(shape)
+    rng = random_source(seed)
+    n = 1
+    for size in shape:
+        n = n * size
+    mines = [is_mine(rng, density) for cell in range(n)]
+
+    start, neighbours = neighbour_index(shape)
+    mine_board = [0] * n
+    mine_field = ["*"] * n
+    for cell in range(n):
+        if not mines[cell]:
+            count = 0
+            for other in neighbours[start[cell]:start[cell + 1]]:
+                if mines[other]:
+                    count += 1
+            mine_board[cell] = count
+            mine_field[cell] = count or blank
+    return nest_cells(mine_board, shape), nest_cells(mine_field, shape)
+
+def mine_board_generator_2d(width, height, density=None, seed=None):
+    '''
+    Return (mine_board, mine_field) for a random width by height board.
+    Each cell is a mine with probability density (1 in 6 if None). If
+    seed is given the board is drawn from its own generator seeded with
+    it, so the same seed always gives the same board; otherwise the
+    global random module is used. See mine_board_generator.
+    '''
+    return mine_board_generator((width, height), density, seed)
+
+def mine_board_generator_3d(width, height, depth, density=None, seed=None):
+    '''3d version of mine_board_generator_2d (a zero clue is shown as 0
+       in the field)'''
+    return mine_board_generator((width, height, depth), density, seed, 0)
+
+
+def mine_board_generator_np(shape, density=1/6, seed=None, blank=" "):
+    '''
+    NumPy version of the generators for a board of any shape (a tuple of
+    sizes). Each cell is a mine with probability density, drawn in one
+    go from a generator seeded with seed. The clue of each cell is the
+    sum of the mine mask shifted by every neighbour offset.
+
+    Returns (mine_board, mine_field, board_array): the board and field in
+    the list of lists format of the other generators (with zero clues
+    shown as blank in the field), and board_array, the ndarray of clues
+    the lists were made from (0 for mines, as in mine_board). Its dtype is
+    the smallest unsigned type holding every clue a board of this many
+    dimensions can have (at most 3**len(shape) - 1): uint8 up to 5
+    dimensions, wider above.
+    '''
+    if numpy is None:
+        raise ImportError("mine_board_generator_np requires numpy")
+
+    rng = numpy.random.default_rng(seed)
+    mines = rng.random(shape) < density
+    padded = numpy.pad(mines.view(numpy.uint8), 1)
+
+    board_array = numpy.zeros(shape, numpy.min_scalar_type(3 ** len(shape) - 1))
+    for offset in itertools.product((0, 1, 2), repeat=len(shape)):
+        board_array += padded[tuple(slice(o, o + n) for o, n in zip(offset, shape))]
+    board_array[mines] = 0
+
+    field = board_array.astype(object)
+    if blank != 0:
+        field[board_array == 0] = blank
+    field[mines] = "*"
+    return board_array.tolist(), field.tolist(), board_array
+
+
+def mine_board_generator_2d_np(width, height, density=1/6, seed=None):
+    '''NumPy version of mine_board_generator_2d, see mine_board_generator_np'''
+    return mine_board_generator_np((width, height), density, seed)
+
+
+def mine_board_generator_3d_np(width, height, depth, density=1/6, seed=None):
+    '''NumPy version of mine_board_generator_3d, see mine_board_generator_np'''
+    return mine_board_generator_np((width, height, depth), density, seed, 0)
@@ -0,0 +1,190 @@
+'''
+Benchmark the minesweeper solver on seeded boards.
+
+Every case is a board shape, a mine density and a propagator. For each
+case a fixed number of boards is generated from fixed seeds (see
+mine_board_generator), so two runs of the benchmark, e.g. on two
+versions of the code, solve exactly the same boards. For each board the
+model build time, search time, peak memory (traced with tracemalloc in
+a separate run, so tracing does not slow the timed run), decisions and
+prunings are recorded.
+
+The report is a dict (saved as JSON) with one entry per case; reports
+can be compared with compare_reports, which lists the cases that got
+slower or whose search changed.
+
+Run as a script:
+   python minesweeper_benchmark.py [report.json [baseline.json]]
+'''
+
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from cspbase import *
+from minesweeper_csp import *
+from mine_board_generator import *
+import propagators
+
+
+#Default sweep
+SHAPES = [(8, 8), (16, 16), (24, 24), (4, 4, 4), (6, 6, 6)]
+DENSITIES = [0.1, 1/6, 0.22]
+PROPAGATORS = [propagators.prop_BT, propagators.prop_FC, propagators.prop_GAC]
+BOARDS = 3              #boards per case
+SEED = 0                #seed of the first board of each case
+MAX_NODES = 100000      #decisions allowed per search before giving up
+
+
+def case_name(shape, density, propagator):
+    '''Return the key of a case in the report, e.g. "16x16-d0.100-prop_GAC"'''
+    return "{}-d{:.3f}-{}".format("x".join(str(n) for n in shape), density,
+                                  propagator.__name__)
+
+
+def generate_board(shape, density, seed):
+    '''Return (board, field) for a seeded board of shape (2d or 3d)'''
+    if len(shape) == 2:
+        return mine_board_generator_2d(shape[0], shape[1], density, seed)
+    return mine_board_generator_3d(shape[0], shape[1], shape[2], density, seed)
+
+
+def build_model(board, dims):
+    '''Return the (csp, variable_array) model of a 2d or 3d board'''
+    if dims == 2:
+        return minesweeper_csp_model_2d(board)
+    return minesweeper_csp_model_3d(board)
+
+
+def run_board(board, dims, propagator, max_nodes=MAX_NODES):
+    '''
+    Build and solve board once. Returns a dict with the model build and
+    search times (CPU seconds), the search status (True, False or None
+    if max_nodes ran out), decisions and prunings.
+    '''
+    stime = time.process_time()
+    csp, variable_array = build_model(board, dims)
+    build_time = time.process_time() - stime
+
+    solver = BT(csp)
+    status = solver.search(propagator, max_nodes)
+    solver.end_search()
+    return {"build_time": build_time,
+            "solve_time": solver.runtime,
+            "status": status,
+            "decisions": solver.nDecisions,
+            "prunings": solver.nPrunings}
+
+
+def peak_memory(board, dims, propagator, max_nodes=MAX_NODES):
+    '''Return the peak memory (bytes) traced while building and solving board'''
+    tracemalloc.start()
+    try:
+        run_board(board, dims, propagator, max_nodes)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_case(shape, density, propagator, boards=BOARDS, seed=SEED,
+             max_nodes=MAX_NODES, memory=True):
+    '''
+    Solve boards seeded boards (seeds seed, seed + 1, ...) of a case.
+    Returns a dict of the totals over the boards (times, decisions,
+    prunings), the largest peak memory, the number of boards solved and
+    of searches stopped by max_nodes, and the per board results.
+    '''
+    runs = []
+    for i in range(boards):
+        board, field = generate_board(shape, density, seed + i)
+        run = run_board(board, len(shape), propagator, max_nodes)
+        if memory:
+            run["peak_memory"] = peak_memory(board, len(shape), propagator, max_nodes)
+        run["seed"] = seed + i
+        runs.append(run)
+
+    case = {"shape": list(shape),
+            "density": density,
+            "propagator": propagator.__name__,
+            "solved": sum(1 for run in runs if run["status"] == True),
+            "stopped": sum(1 for run in runs if run["status"] is None)}
+    for key in ["build_time", "solve_time", "decisions", "prunings"]:
+        case[key] = sum(run[key] for run in runs)
+    if memory:
+        case["peak_memory"] = max(run["peak_memory"] for run in runs)
+    case["runs"] = runs
+    return case
+
+
+def run_benchmark(shapes=SHAPES, densities=DENSITIES, propagators=PROPAGATORS,
+                  boards=BOARDS, seed=SEED, max_nodes=MAX_NODES, memory=True,
+                  verbose=False):
+    '''Run every combination of shape, density and propagator (see
+       run_case) and return the report'''
+    report = {"python": platform.python_version(),
+              "boards": boards,
+              "seed": seed,
+              "max_nodes": max_nodes,
+              "cases": dict()}
+    for shape in shapes:
+        for density in densities:
+            for propagator in propagators:
+                name = case_name(shape, density, propagator)
+                case = run_case(shape, density, propagator, boards, seed, max_nodes, memory)
+                report["cases"][name] = case
+                if verbose:
+                    print("{:30} solved {}/{}  build {:.3f}s  solve {:.3f}s  {} decisions  {} prunings".format(
+                        name, case["solved"], boards, case["build_time"], case["solve_time"],
+                        case["decisions"], case["prunings"]))
+    return report
+
+
+def write_report(report, path):
+    '''Save a report as JSON'''
+    with open(path, "w") as f:
+        json.dump(report, f, indent=1)
+
+
+def read_report(path):
+    '''Load a report saved by write_report'''
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_reports(report, baseline, tolerance=0.2, min_time=0.01):
+    '''
+    Compare report with baseline case by case. Returns a list of
+    (case name, message) for every case of both reports whose status,
+    decisions or prunings differ (the search itself changed), whose
+    build or solve time grew by more than tolerance (a fraction) and at
+    least min_time seconds, or whose peak memory grew by more than
+    tolerance.
+    '''
+    changes = []
+    for name, case in report["cases"].items():
+        old = baseline["cases"].get(name)
+        if old is None:
+            continue
+        for key in ["solved", "stopped", "decisions", "prunings"]:
+            if case[key] != old[key]:
+                changes.append((name, "{} {} -> {}".format(key, old[key], case[key])))
+        for key in ["build_time", "solve_time"]:
+            if case[key] > old[key] * (1 + tolerance) and case[key] - old[key] >= min_time:
+                changes.append((name, "{} {:.3f}s -> {:.3f}s".format(key, old[key], case[key])))
+        if "peak_memory" in case and "peak_memory" in old:
+            if case["peak_memory"] > old["peak_memory"] * (1 + tolerance):
+                changes.append((name, "peak_memory {} -> {}".format(old["peak_memory"], case["peak_memory"])))
+    return changes
+
+
+if __name__ == "__main__":
+    report = run_benchmark(verbose=True)
+    if len(sys.argv) > 1:
+        write_report(report, sys.argv[1])
+    if len(sys.argv) > 2:
+        changes = compare_reports(report, read_report(sys.argv[2]))
+        for name, message in changes:
+            print(name, message)
+        if not changes:
+            print("No changes from baseline")
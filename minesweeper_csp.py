@@ -3,11 +3,55 @@ Construct and return minesweeper CSP models.
 '''
 
 from cspbase import *
+import array
+import functools
 import itertools
 import propagators
 
 
-def minesweeper_csp_model_2d(initial_mine_board):
+#The number of distinct clue tables kept by clue_table
+CLUE_TABLE_CACHE_SIZE = 1024
+
+
+def minesweeper_csp_model(initial_mine_board, use_tables=False, total_mines=None, lazy=False):
+    '''
+    Return (csp, variable_array) modelling a minesweeper board with any
+    number of dimensions, given as nested lists of clues (0 for a cell
+    without one). variable_array holds the variables in the same nesting.
+    See minesweeper_csp_model_2d for the model and the options.
+
+    The cells are numbered in row-major order and the board is worked on
+    flat, with the neighbours of every cell taken from neighbour_index.
+    '''
+    shape = board_shape(initial_mine_board)
+    board = flatten_cells(initial_mine_board, len(shape))
+    start, neighbours = neighbour_index(shape)
+    names = [",".join([str(i) for i in index]) for index in itertools.product(*[range(size) for size in shape])]
+
+    variables = []
+    for cell in range(len(board)):
+        if board[cell] == 0:
+            variable = Variable("V({})".format(names[cell]), [" ", "*"])
+        else:
+            variable = Variable("V({})".format(names[cell]), [board[cell]])
+        variables.append(variable)
+    reduce_cells(variables, board, shape)
+    mine_csp = CSP("Minesweeper-{}d".format(len(shape)), variables)
+
+    # add constraints here
+    for cell in range(len(board)):
+        if board[cell] != 0:
+            scope = [variables[other] for other in neighbours[start[cell]:start[cell + 1]]]
+            mine_csp.add_constraint(clue_constraint("C{}".format(names[cell]), scope, board[cell],
+                                                    use_tables, lazy))
+
+    if total_mines is not None:
+        mine_csp.add_constraint(total_constraint(variables, total_mines))
+
+    return mine_csp, nest_cells(variables, shape)
+
+
+def minesweeper_csp_model_2d(initial_mine_board, use_tables=False, total_mines=None, lazy=False):
     '''
     Return a CSP object representing a minesweeper game.
 
@@ -31,135 +75,432 @@ def minesweeper_csp_model_2d(initial_mine_board):
        |*|1|2|*|2| |1|1|1|
        |1|1|2|*|2| | | | |
        -------------------
+
+    Each clue becomes a CountConstraint ("exactly N mines around").
+    If use_tables is True the clues are instead built as table
+    constraints listing every satisfying assignment of the neighbours.
+
+    If total_mines (the number of mines the game says the board has) is
+    given, a TotalCountConstraint over all unknown cells is added too.
+
+    If lazy is True and use_tables is True, the table of each clue is
+    only built when search first uses it (see LazyConstraint); without
+    tables lazy changes nothing. Only BT and FC search leave tables
+    unbuilt: GAC revises every constraint at the root, which builds them
+    all.
     '''
-    variables = []
-    variable_array = []
-    for i in range(0, len(initial_mine_board)):
-        row = []
-        for j in range(0, len(initial_mine_board[0])):
-            if initial_mine_board[i][j] == 0:
-                variable = Variable("V({},{})".format(i, j), [" ", "*"])
+    return minesweeper_csp_model(initial_mine_board, use_tables, total_mines, lazy)
+
+
+def minesweeper_csp_model_3d(initial_mine_board, use_tables=False, total_mines=None, lazy=False):
+    '''
+    Return a CSP object representing a 3d minesweeper game, built in the
+    same way as minesweeper_csp_model_2d (including the lazy mode).
+    '''
+    return minesweeper_csp_model(initial_mine_board, use_tables, total_mines, lazy)
+
+
+class IncrementalModel:
+    '''
+    A minesweeper CSP kept up to date while a game is played, rather than
+    rebuilt and solved from scratch after every move.
+
+    The model is built once from the initial board (as by the 2d/3d
+    builders) and GAC is established on it. Each reveal then adds the
+    constraints the new information gives (the cell is not a mine, and
+    exactly 'clue' of its neighbours are) and re-runs GAC with only those
+    constraints on the queue, so the work done per move follows the cells
+    the move affects, not the size of the board.
+
+    The variables' current domains always hold what is known: a cell is
+    safe once "*" is pruned from its domain, a mine once only "*" is
+    left. Revealed cells keep the domain [" ", "*"] and end up with " ".
+    A full solution can be searched for at any point with solve; the
+    search starts from the constraints, which record every reveal. (Do
+    not hand the CSP to BT directly: a search clears the propagated
+    domains and leaves its solution assigned.)
+    '''
+
+    def __init__(self, initial_mine_board, use_tables=False, total_mines=None):
+        '''
+        Build the model of initial_mine_board (a board of any dimension, with 0
+        for unknown cells) and propagate it. Unknown cells are not assumed
+        safe, even away from any clue.
+        '''
+        self.shape = board_shape(initial_mine_board)
+        self.use_tables = use_tables
+        self.csp, self.variable_array = minesweeper_csp_model(initial_mine_board, use_tables, total_mines)
+
+        self.cell_of = dict()
+        self.revealed = dict()  #cell -> its clue, None if only known safe
+        for cell in itertools.product(*[range(size) for size in self.shape]):
+            variable = self.get_variable(cell)
+            self.cell_of[variable] = cell
+            clue = get_cell(initial_mine_board, cell)
+            if clue != 0:
+                self.revealed[cell] = clue
+        self.propagate_all()
+
+    def propagate_all(self):
+        '''Clear all assignments and prunings and establish GAC on the
+           whole model again from its constraints'''
+        for variable in self.csp.vars:
+            if variable.is_assigned():
+                variable.unassign()
+            variable.restore_curdom()
+        self.trail = Trail()
+        self.status = propagators.prop_GAC(self.csp, None, self.trail)
+
+    def solve(self, propagator=propagators.prop_GAC, max_nodes=None, max_time=None):
+        '''
+        Search for a full solution consistent with everything revealed so
+        far. Returns the SearchResult of BT.solve, whose values are a
+        snapshot of the model's variables (see BT.decode_snapshot). The
+        model is then put back as it was: the solution is unassigned (a
+        paused search is ended, not kept) and GAC re-established.
+        '''
+        solver = BT(self.csp)
+        result = solver.solve(propagator, max_nodes, max_time)
+        if result.status is None:
+            solver.end_search()
+        self.propagate_all()
+        return result
+
+    def get_variable(self, cell):
+        '''Return the variable of cell (an index tuple)'''
+        return get_cell(self.variable_array, cell)
+
+    def reveal(self, cell, clue):
+        '''
+        Record that cell (an index tuple) holds no mine and that exactly
+        clue of its neighbours do (clue None if only the first is known),
+        then propagate.
+
+        Returns (status, determined). status is False if the move
+        contradicts what is known; the model is then left as it was
+        before the move. determined maps each cell whose value became
+        known through the move to that value (" " or "*").
+
+        A 0 revealed among known clues has no neighbour left that can
+        be a mine, which table models handle too:
+
+        >>> board = [[0, 0, 0, 0, 0], [0, 1, 1, 1, 0], [0, 1, 0, 1, 0],
+        ...          [0, 1, 1, 1, 0], [0, 0, 0, 0, 0]]
+        >>> IncrementalModel(board, use_tables=True).reveal((2, 2), 0)
+        (True, {(2, 2): ' '})
+        '''
+        if not self.status:
+            return False, dict()
+        known = cell in self.revealed
+        if known and (clue is None or self.revealed[cell] is not None):
+            return self.revealed[cell] == clue or clue is None, dict()
+
+        name = ",".join(str(i) for i in cell)
+        variable = self.get_variable(cell)
+        constraints = []
+        if not known:
+            constraints.append(CountConstraint("R{}".format(name), [variable], "*", 0))
+        if clue is not None:
+            scope = [self.get_variable(other) for other in get_cells_around(cell, self.shape)]
+            constraints.append(clue_constraint("C{}".format(name), scope, clue, self.use_tables))
+        for constraint in constraints:
+            self.csp.add_constraint(constraint)
+
+        mark = self.trail.mark()
+        if not propagators.gac_enforce(self.csp, constraints, self.trail):
+            self.trail.undo(mark)
+            for constraint in constraints:
+                self.csp.remove_constraint(constraint)
+            return False, dict()
+        self.revealed[cell] = clue
+
+        determined = dict()
+        for variable in self.trail.vars[mark:]:
+            if variable.cur_domain_size() == 1:
+                determined[self.cell_of[variable]] = variable.cur_domain()[0]
+        return True, determined
+
+
+#Value of a mine in the bytes grid of a BoardResult (boards of up to 5
+#dimensions, whose clues are at most 3**5 - 1 = 242)
+MINE = 255
+
+
+def grid_type(dims):
+    '''
+    Return (typecode, mine) for the grid of a board with dims dimensions:
+    the smallest array typecode whose values hold every clue (at most
+    3**dims - 1) and the value marking a mine, the largest of the type
+    ("B" and MINE up to 5 dimensions).
+    '''
+    for typecode in ["B", "H", "L"]:
+        mine = (1 << (8 * array.array(typecode).itemsize)) - 1
+        if 3 ** dims - 1 < mine:
+            return typecode, mine
+    raise ValueError("no grid type for a board of {} dimensions".format(dims))
+
+
+class BoardResult(SearchResult):
+    '''
+    The outcome of solve_board: a SearchResult (status, values, stats)
+    that also holds the solution as a compact grid. shape is the shape of
+    the board and grid its cells in row-major order: mine for a mine,
+    otherwise the cell's clue, 0 for a cell without one. grid is None if
+    no solution was found. Up to 5 dimensions grid is bytes and mine is
+    MINE; boards of more dimensions have larger clues, and grid is an
+    array of a wider type (see grid_type).
+    '''
+
+    def __init__(self, status, values, stats, shape, grid, mine=MINE):
+        SearchResult.__init__(self, status, values, stats)
+        self.shape = shape
+        self.grid = grid
+        self.mine = mine
+
+    def get_field(self):
+        '''Return the solution as nested lists like the mine_field of the
+           board generators ("*" for a mine, " " for a cell without a
+           clue), None if there is none'''
+        if self.grid is None:
+            return None
+        return nest_cells(["*" if cell == self.mine else (cell or " ") for cell in self.grid], self.shape)
+
+
+def solve_board(initial_mine_board, propagator=propagators.prop_GAC, use_tables=False,
+                total_mines=None, max_nodes=None, max_time=None, verbose=False, lazy=False):
+    '''
+    Build the model of a board (2d, 3d or more) and solve it with BT.solve,
+    printing nothing unless verbose is True. Returns a BoardResult.
+    '''
+    shape = board_shape(initial_mine_board)
+    csp, variable_array = minesweeper_csp_model(initial_mine_board, use_tables, total_mines, lazy)
+
+    result = BT(csp).solve(propagator, max_nodes, max_time, verbose)
+    typecode, mine = grid_type(len(shape))
+    grid = None
+    if result.status == True:
+        #the variables are in row-major order
+        cells = [mine if value == "*" else (0 if value == " " else value)
+                 for value in [variable.get_assigned_value() for variable in csp.vars]]
+        if typecode == "B":
+            grid = bytes(cells)
+        else:
+            grid = array.array(typecode, cells)
+    return BoardResult(result.status, result.values, result.stats, shape, grid, mine)
+
+
+def board_shape(board):
+    '''Return the shape (tuple of sizes) of a board of nested lists'''
+    shape = []
+    while isinstance(board, list):
+        shape.append(len(board))
+        board = board[0]
+    return tuple(shape)
+
+
+#The number of board shapes whose neighbour_index is kept. Each entry is
+#a full index (about 64 MB for a 1000x1000 board), so only a handful are:
+#enough for the builder, reduction and generator to share one per board.
+NEIGHBOUR_INDEX_CACHE_SIZE = 4
+
+
+@functools.lru_cache(maxsize=NEIGHBOUR_INDEX_CACHE_SIZE)
+def neighbour_index(shape):
+    '''
+    Return (start, neighbours), the neighbours of every cell of a board of
+    the given shape (a tuple of sizes, any number of dimensions) in CSR
+    form: with the cells numbered in row-major order, the neighbours of
+    cell c are neighbours[start[c]:start[c + 1]], in row-major order.
+    Both are arrays of ints. The index is built once per shape and shared
+    by the model builder, the reduction and the board generators.
+    '''
+    strides = []
+    n = 1
+    for size in reversed(shape):
+        strides.insert(0, n)
+        n = n * size
+    offsets = [offset for offset in itertools.product((-1, 0, 1), repeat=len(shape)) if any(offset)]
+    steps = [sum(d * stride for d, stride in zip(offset, strides)) for offset in offsets]
+
+    start = array.array('l', [0])
+    neighbours = array.array('l')
+    for cell, index in enumerate(itertools.product(*[range(size) for size in shape])):
+        for offset, step in zip(offsets, steps):
+            for i, d, size in zip(index, offset, shape):
+                if not 0 <= i + d < size:
+                    break
             else:
-                variable = Variable("V({},{})".format(i, j), [initial_mine_board[i][j]])
-            variables.append(variable)
-            row.append(variable)
-        variable_array.append(row)
-    reduce(variable_array, initial_mine_board)
-    mine_csp = CSP("Minesweeper-2d", variables)
+                neighbours.append(cell + step)
+        start.append(len(neighbours))
+    return start, neighbours
 
-    # add constraints here
-    for i in range(0, len(variable_array)):
-        for j in range(0, len(variable_array[0])):
-            if initial_mine_board[i][j] != 0:
-                constraint = Constraint("C{},{}".format(i, j), get_variables_around(i, j, variable_array))
-
-                domain = []
-                for k in range(-1, 2):
-                    for l in range(-1, 2):
-                        if not (k == 0 and l == 0) and 0 <= (i + k) < len(variable_array) and 0 <= (j + l) < len(variable_array[0]):
-                            domain.append(variable_array[i + k][j + l].cur_domain())
-                holder = [0 for i in range(len(domain))]
-                sat_tuples = []
-                recursive_sat(domain, holder, sat_tuples, initial_mine_board[i][j])
-                constraint.add_satisfying_tuples(sat_tuples)
-                mine_csp.add_constraint(constraint)
-
-    return mine_csp, variable_array
-
-
-def minesweeper_csp_model_3d(initial_mine_board):
-    variables = []
-    variable_array = []
-    for i in range(0, len(initial_mine_board)):
-        layer = []
-        for j in range(0, len(initial_mine_board[0])):
-            row = []
-            for k in range(0, len(initial_mine_board[0][0])):
-                if initial_mine_board[i][j][k] == 0:
-                    variable = Variable("V({},{},{})".format(i, j, k), [" ", "*"])
-                else:
-                    variable = Variable("V({},{},{})".format(i, j, k), [initial_mine_board[i][j][k]])
-                variables.append(variable)
-                row.append(variable)
-            layer.append(row)
-        variable_array.append(layer)
-
-    reduce_3d(variable_array, initial_mine_board)
-    mine_csp = CSP("Minesweeper-3d", variables)
 
-    # add constraints here
-    for i in range(0, len(variable_array)):
-        for j in range(0, len(variable_array[0])):
-            for k in range(0, len(variable_array[0][0])):
-                if initial_mine_board[i][j][k] != 0:
-                    constraint = Constraint("C{},{},{}".format(i, j, k), get_variables_3d(i, j, k, variable_array))
-
-                    domain = []
-                    for l in range(-1, 2):
-                        for m in range(-1, 2):
-                            for n in range(-1, 2):
-                                if not (l == 0 and m == 0 and n == 0) and 0 <= (i + l) < len(variable_array) and 0 <= (j + m) < len(variable_array[0]) and 0 <= (k + n) < len(variable_array[0][0]):
-                                    domain.append(variable_array[i + l][j + m][k + n].cur_domain())
-                    holder = [0 for i in range(len(domain))]
-                    sat_tuples = []
-                    recursive_sat(domain, holder, sat_tuples, initial_mine_board[i][j][k])
-                    constraint.add_satisfying_tuples(sat_tuples)
-                    mine_csp.add_constraint(constraint)
-
-    return mine_csp, variable_array
+def cells_around(index, shape):
+    '''Return the flat numbers of the cells next to the cell at index
+       (a tuple) on a board of the given shape'''
+    start, neighbours = neighbour_index(tuple(shape))
+    cell = ravel_cell(index, shape)
+    return neighbours[start[cell]:start[cell + 1]]
+
+
+def ravel_cell(index, shape):
+    '''Return the row-major number of the cell at index'''
+    cell = 0
+    for i, size in zip(index, shape):
+        cell = cell * size + i
+    return cell
+
+
+def unravel_cell(cell, shape):
+    '''Return the index tuple of the cell numbered cell in row-major order'''
+    index = []
+    for size in reversed(shape):
+        cell, i = divmod(cell, size)
+        index.insert(0, i)
+    return tuple(index)
+
+
+def get_cell(board, index):
+    '''Return the item at index tuple index of nested lists board'''
+    for i in index:
+        board = board[i]
+    return board
+
+
+def flatten_cells(board, dims):
+    '''Return the items of dims deep nested lists in row-major order'''
+    for i in range(dims - 1):
+        board = [item for row in board for item in row]
+    return list(board)
+
+
+def nest_cells(cells, shape):
+    '''Return the row-major list cells as nested lists of the given shape'''
+    for size in reversed(shape[1:]):
+        cells = [cells[i:i + size] for i in range(0, len(cells), size)]
+    return cells
+
+
+def get_cells_around(cell, shape):
+    '''Return the index tuples of the cells next to cell on a board of
+       the given shape (any number of dimensions)'''
+    return [unravel_cell(other, shape) for other in cells_around(cell, shape)]
+
+
+def total_constraint(variables, total_mines):
+    '''
+    Return the constraint that exactly total_mines of the cells that may
+    hold a mine do.
+    '''
+    return TotalCountConstraint("Total", [variable for variable in variables if "*" in variable.dom],
+                                "*", total_mines)
+
+
+def clue_constraint(name, scope, clue, use_tables=False, lazy=False):
+    '''
+    Return the constraint saying exactly 'clue' of the variables in scope
+    are mines. By default this is a CountConstraint; with use_tables the
+    satisfying tuples over the current domains are enumerated instead.
+
+    Neighbours that can never be mines (known clue cells) cannot change
+    the count, so they are left out of the scope. If that leaves none
+    although the clue is not 0, the scope is kept whole so the (then
+    unsatisfiable) constraint is still checked by search.
+
+    If lazy is True, a table constraint is a LazyConstraint holding only
+    its scope and clue until its table is first used.
+    '''
+    if clue == 0 or any("*" in variable.dom for variable in scope):
+        scope = [variable for variable in scope if "*" in variable.dom]
+    if not use_tables:
+        return CountConstraint(name, scope, "*", clue)
+
+    if lazy:
+        #the table is over the neighbours' permanent domains, which is
+        #what their current domains are while a model is built
+        return LazyConstraint(name, scope,
+                              lambda: clue_table(tuple(tuple(variable.dom) for variable in scope), clue))
+    signature = tuple(tuple(variable.cur_domain()) for variable in scope)
+    constraint = Constraint(name, scope)
+    constraint.set_satisfying_table(clue_table(signature, clue))
+    return constraint
+
+
+@functools.lru_cache(maxsize=CLUE_TABLE_CACHE_SIZE)
+def clue_table(signature, clue):
+    '''
+    Return the TupleTable of assignments to a clue's neighbours having
+    exactly 'clue' mines, where signature gives the neighbours' current
+    domains (a tuple of tuples). Only a few signatures occur on a board
+    (corners, edges, interior, next to known cells...), so the tables
+    are cached and shared by all clues with the same signature.
+
+    A clue of 0 may have no neighbour left that can be a mine (an empty
+    signature); its table then holds just the empty assignment.
+
+    >>> list(clue_table((), 0).sat_tuples)
+    [()]
+    '''
+    if not signature:
+        return TupleTable([()] if clue == 0 else [])
+    domain = [list(values) for values in signature]
+    holder = [0 for i in range(len(domain))]
+    sat_tuples = []
+    recursive_sat(domain, holder, sat_tuples, clue)
+    return TupleTable(sat_tuples)
+
+
+def reduce_cells(variables, board, shape):
+    '''Prune "*" from the cells (flat lists of variables and clues of a
+       board of the given shape) that have no clue around them: nothing
+       can show whether they hold a mine'''
+    start, neighbours = neighbour_index(tuple(shape))
+    for cell in range(len(board)):
+        if board[cell] == 0:
+            for other in neighbours[start[cell]:start[cell + 1]]:
+                if board[other] != 0:
+                    break
+            else:
+                variables[cell].prune_value("*")
 
 
 def reduce(table, initial):
-    for i in range(0, len(initial)):
-        for j in range(0, len(initial[0])):
-            if initial[i][j] == 0 and no_indicator(initial, i, j):
-                table[i][j].prune_value("*")
+    shape = board_shape(initial)
+    reduce_cells(flatten_cells(table, len(shape)), flatten_cells(initial, len(shape)), shape)
 
 
 def no_indicator(initial, i, j):
-    for k in range(-1, 2):
-        for l in range(-1, 2):
-            if 0 <= (i + k) < len(initial) and 0 <= (j + l) < len(initial[0]):
-                if initial[i + k][j + l] !=0:
-                    return False
+    shape = board_shape(initial)
+    if initial[i][j] != 0:
+        return False
+    for other in cells_around((i, j), shape):
+        if get_cell(initial, unravel_cell(other, shape)) != 0:
+            return False
     return True
 
 
 def reduce_3d(table, initial):
-    for i in range(0, len(initial)):
-        for j in range(0, len(initial[0])):
-            for k in range(0, len(initial[0][0])):
-                if initial[i][j][k] == 0 and no_indicator_3d(initial, i, j, k):
-                    table[i][j][k].prune_value("*")
+    reduce(table, initial)
 
 
 def no_indicator_3d(initial, i, j, k):
-    for l in range(-1, 2):
-        for m in range(-1, 2):
-            for n in range(-1, 2):
-                if 0 <= (i + l) < len(initial) and 0 <= (j + m) < len(initial[0]) and 0 <= (k + n) < len(initial[0][0]):
-                    if initial[i + l][j + m][k + n] !=0:
-                        return False
+    shape = board_shape(initial)
+    if initial[i][j][k] != 0:
+        return False
+    for other in cells_around((i, j, k), shape):
+        if get_cell(initial, unravel_cell(other, shape)) != 0:
+            return False
     return True
 
 
 def get_variables_around(i, j, table):
-    array = []
-    for k in range(-1, 2):
-        for l in range(-1, 2):
-            if not(k == 0 and l == 0) and 0 <= (i + k) < len(table) and 0 <= (j + l) < len(table[0]):
-                array.append(table[i + k][j + l])
-    return array
+    shape = board_shape(table)
+    return [get_cell(table, unravel_cell(other, shape)) for other in cells_around((i, j), shape)]
 
 
 def get_variables_3d(i, j, k, table):
-    array = []
-    for l in range(-1, 2):
-        for m in range(-1, 2):
-            for n in range(-1, 2):
-                if not(l == 0 and m == 0 and n == 0) and 0 <= (i + l) < len(table) and 0 <= (j + m) < len(table[0]) and 0 <= (k + n) < len(table[0][0]):
-                    array.append(table[i + l][j + m][k + n])
-    return array
+    shape = board_shape(table)
+    return [get_cell(table, unravel_cell(other, shape)) for other in cells_around((i, j, k), shape)]
 
 
 def recursive_sat(domain, holder, sat_tuples, value):
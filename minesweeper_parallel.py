@@ -0,0 +1,338 @@
+'''
+Solve minesweeper boards, or the independent components of one board,
+in parallel on a pool of worker processes.
+
+Work is shipped to the workers in a compact picklable form: a board is
+its shape plus the bytes of its flattened clues, a CSP is a list of
+variable domains plus constraints whose scopes are lists of variable
+indices. Results come back in the order the work was given.
+
+solve_portfolio instead races differently configured searches of the
+same board against each other: the first to finish wins and the others
+are told to stop through a shared Event they check between slices of
+their search. Wins can be tallied in a JSON file to tune the default.
+'''
+
+import array
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import Manager
+from cspbase import *
+from minesweeper_csp import *
+import heuristics
+import propagators
+
+
+#Configurations raced by solve_portfolio. Each is a dict with the keys
+#   propagator   a function of the propagators module
+#   value_order  a function of the heuristics module, or None
+#   random_ties  seed for random MRV tie-breaking, or None
+#   cbj          True to backjump and learn nogoods
+#   restarts     True to restart on a Luby schedule
+PORTFOLIO = [
+    {"propagator": propagators.prop_GAC},
+    {"propagator": propagators.prop_FC},
+    {"propagator": propagators.prop_GAC, "value_order": heuristics.val_probability},
+    {"propagator": propagators.prop_FC, "cbj": True},
+    {"propagator": propagators.prop_GAC, "random_ties": 0, "restarts": True, "cbj": True},
+    {"propagator": propagators.prop_FC, "random_ties": 1, "restarts": True,
+     "value_order": heuristics.val_lcv},
+]
+
+#Decisions a portfolio search makes between checks of the stop Event
+PORTFOLIO_SLICE = SLICE_NODES
+
+
+def encode_board(board):
+    '''
+    Return (shape, data) for a board of any dimension (nested lists of clues),
+    where data holds the clues in row-major order: bytes, or an array of
+    a wider type for boards of more than 5 dimensions (see grid_type).
+    '''
+    shape = []
+    cells = board
+    while isinstance(cells, list):
+        shape.append(len(cells))
+        cells = cells[0]
+
+    flat = board
+    for i in range(len(shape) - 1):
+        flat = [cell for row in flat for cell in row]
+    typecode, mine = grid_type(len(shape))
+    if typecode == "B":
+        return tuple(shape), bytes(flat)
+    return tuple(shape), array.array(typecode, flat)
+
+
+def decode_board(encoded):
+    '''Rebuild the list of lists board from encode_board's output'''
+    shape, data = encoded
+    board = list(data)
+    for size in reversed(shape[1:]):
+        board = [board[i:i + size] for i in range(0, len(board), size)]
+    return board
+
+
+def encode_csp(csp):
+    '''
+    Return a picklable description of csp:
+    (name, variable names, variable domains, constraints), where each
+    constraint is (name, scope indices, value, count, class) for a
+    CountConstraint, class being the CountConstraint subclass (e.g.
+    TotalCountConstraint) to rebuild, and (name, scope indices,
+    satisfying tuples) for a table Constraint.
+    '''
+    index = dict()
+    for i, var in enumerate(csp.vars):
+        index[var] = i
+    cons = []
+    for c in csp.cons:
+        scope = tuple(index[var] for var in c.scope)
+        if isinstance(c, CountConstraint):
+            cons.append((c.name, scope, c.value, c.count, type(c)))
+        else:
+            cons.append((c.name, scope, tuple(c.sat_tuples)))
+    return (csp.name, [var.name for var in csp.vars],
+            [var.domain() for var in csp.vars], cons)
+
+
+def decode_csp(encoded):
+    '''Rebuild a CSP (with new variables and constraints) from encode_csp's output'''
+    name, names, domains, cons = encoded
+    variables = [Variable(n, d) for n, d in zip(names, domains)]
+    csp = CSP(name, variables)
+    for con in cons:
+        scope = [variables[i] for i in con[1]]
+        if len(con) == 5:
+            constraint = con[4](con[0], scope, con[2], con[3])
+        else:
+            constraint = Constraint(con[0], scope)
+            constraint.add_satisfying_tuples(con[2])
+        csp.add_constraint(constraint)
+    return csp
+
+
+def solver_stats(solver):
+    '''Return the statistics of a BT solver as a dict'''
+    return solver.get_stats()
+
+
+def solve_board_task(task):
+    '''
+    Worker: solve one encoded board. task is (encoded board, propagator,
+    use_tables). Returns (status, solution, stats) where solution is
+    shaped like the board and holds the value assigned to each cell
+    (None if unsolved).
+    '''
+    encoded, propagator, use_tables = task
+    csp, variable_array = minesweeper_csp_model(decode_board(encoded), use_tables)
+
+    solver = BT(csp)
+    status = solver.search(propagator)
+    solver.end_search()
+    return status, assigned_values(variable_array), solver_stats(solver)
+
+
+def solve_csp_task(task):
+    '''
+    Worker: solve one encoded CSP. task is (encoded csp, propagator).
+    Returns (status, values, stats) with values the value assigned to
+    each variable in order (None if unsolved).
+    '''
+    encoded, propagator = task
+    csp = decode_csp(encoded)
+    solver = BT(csp)
+    status = solver.search(propagator)
+    solver.end_search()
+    return status, [var.get_assigned_value() for var in csp.vars], solver_stats(solver)
+
+
+def assigned_values(variable_array):
+    '''Return the assigned values of a nested variable array, same shape'''
+    if isinstance(variable_array, list):
+        return [assigned_values(item) for item in variable_array]
+    return variable_array.get_assigned_value()
+
+
+def solve_boards(boards, propagator=propagators.prop_GAC, use_tables=False,
+                 max_workers=None, chunksize=1):
+    '''
+    Solve a batch of boards (of any dimension) on a process pool. Returns
+    a list with one (status, solution, stats) triple per board, in input
+    order (see solve_board_task). propagator must be picklable, e.g. one of the
+    propagators module's functions.
+    '''
+    tasks = [(encode_board(board), propagator, use_tables) for board in boards]
+    with ProcessPoolExecutor(max_workers) as pool:
+        return list(pool.map(solve_board_task, tasks, chunksize=chunksize))
+
+
+def solve_components(csp, propagator=propagators.prop_GAC, max_workers=None,
+                     chunksize=1):
+    '''
+    Solve the connected components of csp (see CSP.get_components) in
+    parallel and assign the solutions to csp's variables, so they also
+    appear in the model's variable_array. Variables in no constraint are
+    grouped into one component.
+
+    Returns (status, stats) where status is True if every component was
+    solved and stats lists the stats dict of each component's search,
+    in the order the components were found.
+    '''
+    components = []
+    free = []
+    for component in csp.get_components():
+        if len(component) == 1 and not csp.vars_to_cons[component[0]]:
+            free.append(component[0])
+        else:
+            components.append(component)
+    if free:
+        components.append(free)
+
+    tasks = []
+    for i, component in enumerate(components):
+        sub = csp.get_sub_csp("{}-{}".format(csp.name, i), component)
+        tasks.append((encode_csp(sub), propagator))
+    with ProcessPoolExecutor(max_workers) as pool:
+        results = list(pool.map(solve_csp_task, tasks, chunksize=chunksize))
+
+    status = True
+    stats = []
+    for component, (solved, values, stat) in zip(components, results):
+        stats.append(stat)
+        for var, val in zip(component, values):
+            if var.is_assigned():
+                var.unassign()
+            var.restore_curdom()
+            if solved:
+                var.assign(val)
+        status = status and solved
+    return status, stats
+
+
+def config_name(config):
+    '''Return a readable name for a portfolio configuration, e.g.
+       "prop_GAC+val_probability+cbj"'''
+    parts = [config["propagator"].__name__]
+    if config.get("value_order") is not None:
+        parts.append(config["value_order"].__name__)
+    if config.get("random_ties") is not None:
+        parts.append("random{}".format(config["random_ties"]))
+    if config.get("cbj"):
+        parts.append("cbj")
+    if config.get("restarts"):
+        parts.append("restarts")
+    return "+".join(parts)
+
+
+def configure_solver(csp, config):
+    '''Return a BT solver for csp set up as config says'''
+    solver = BT(csp)
+    solver.set_value_order(config.get("value_order"))
+    if config.get("random_ties") is not None:
+        solver.set_random_ties(config["random_ties"])
+    if config.get("cbj"):
+        solver.cbj_on()
+    return solver
+
+
+def portfolio_task(task):
+    '''
+    Worker: solve one encoded board with one portfolio configuration.
+    task is (encoded board, config, use_tables, stop, slice_nodes,
+    max_nodes). Returns (status, solution, stats) as solve_board_task
+    does; status is None if the search was stopped by the Event stop,
+    checked every slice_nodes decisions (see BT.resume_slices), or ran
+    out of decisions. If stop is already set the board is not even
+    modelled, and (None, None, None) is returned.
+    '''
+    encoded, config, use_tables, stop, slice_nodes, max_nodes = task
+    if stop.is_set():
+        return None, None, None
+    csp, variable_array = minesweeper_csp_model(decode_board(encoded), use_tables)
+
+    solver = configure_solver(csp, config)
+    propagator = config["propagator"]
+    if config.get("restarts"):
+        status = solver.search_restarts(propagator, max_nodes=max_nodes,
+                                        stop=stop.is_set, slice_nodes=slice_nodes)
+    else:
+        solver.search_start(propagator)
+        status = solver.resume_slices(max_nodes, None, stop.is_set, slice_nodes)
+    solver.end_search()
+    return status, assigned_values(variable_array), solver_stats(solver)
+
+
+def solve_portfolio(board, configs=PORTFOLIO, use_tables=False, max_workers=None,
+                    slice_nodes=PORTFOLIO_SLICE, max_nodes=None, record=None):
+    '''
+    Race the portfolio configs on a board, one worker process each
+    (up to max_workers at a time). The first search to finish (True or
+    False) wins; the others are stopped at the end of their current
+    slice of slice_nodes decisions, and those not started yet are
+    cancelled. max_nodes bounds the decisions of each search.
+
+    Returns (status, solution, winner, results): the winner's status and
+    solution (see solve_board_task), the winner's name (config_name),
+    and a dict from each configuration's name to its (status, stats),
+    status None for the searches that were stopped (those cancelled or
+    stopped before they began are left out). If no search
+    finished, status and winner are None. If record is a path, the win
+    is tallied there (see record_win).
+    '''
+    encoded = encode_board(board)
+    if max_workers is None:
+        max_workers = len(configs)
+    status = None
+    solution = None
+    winner = None
+    results = dict()
+    with Manager() as manager:
+        stop = manager.Event()
+        with ProcessPoolExecutor(max_workers) as pool:
+            futures = dict()
+            for config in configs:
+                task = (encoded, config, use_tables, stop, slice_nodes, max_nodes)
+                futures[pool.submit(portfolio_task, task)] = config_name(config)
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                name = futures[future]
+                solved, values, stats = future.result()
+                if stats is None:
+                    continue
+                results[name] = (solved, stats)
+                if solved is not None and winner is None:
+                    status, solution, winner = solved, values, name
+                    stop.set()
+                    for other in futures:
+                        other.cancel()
+
+    if record is not None and winner is not None:
+        record_win(record, winner)
+    return status, solution, winner, results
+
+
+def read_wins(path):
+    '''Return the dict from configuration name to wins tallied in path
+       (empty if there is no such file)'''
+    if not os.path.exists(path):
+        return dict()
+    with open(path) as f:
+        return json.load(f)
+
+
+def record_win(path, name):
+    '''Add a win for the configuration name to the tally in path'''
+    wins = read_wins(path)
+    wins[name] = wins.get(name, 0) + 1
+    with open(path, "w") as f:
+        json.dump(wins, f, indent=1, sort_keys=True)
+
+
+def rank_configs(path, configs=PORTFOLIO):
+    '''Return configs ordered by their wins tallied in path, most first
+       (e.g. to pick a default, or to race only the best few)'''
+    wins = read_wins(path)
+    return sorted(configs, key=lambda config: -wins.get(config_name(config), 0))
@@ -0,0 +1,246 @@
+'''
+Exact per-cell mine probabilities for a minesweeper CSP.
+
+The probability of a cell is the fraction of all consistent assignments
+(solutions of the CSP) in which it holds a mine. Solutions are never
+enumerated. Each connected component of the CSP is counted on its own by
+dynamic programming over its variables in order: the state after the
+first i variables is what the constraints still open at that point have
+seen so far (the number of mines for a CountConstraint, the values so
+far for a table Constraint). Equal states are merged, so the work grows
+with the number of distinct frontier states rather than the number of
+solutions.
+
+Counts are kept as polynomials in the number of mines (lists indexed by
+mine count). This lets the components be combined exactly when the total
+number of mines on the board is known: a combination of components with
+k mines in all leaves C(F, total - k) ways to place the rest among the F
+cells that no clue constrains.
+'''
+
+from fractions import Fraction
+from math import comb
+from cspbase import *
+
+
+def mine_probabilities(csp, variable_array=None, total_mines=None, mine="*",
+                       exact=False):
+    '''
+    Return the probability that each variable of csp takes the value mine,
+    over all assignments consistent with the current domains and the
+    constraints. If total_mines is given only assignments with exactly
+    that many mines in all are counted.
+
+    If variable_array (nested lists of the csp's variables, as returned by
+    the model builders) is given, the result has the same shape and holds
+    each variable's probability; otherwise it is a dict from variable to
+    probability. Probabilities are floats, or Fractions if exact is True.
+    Returns None if there is no consistent assignment.
+
+    A TotalCountConstraint counting mines in the csp is not counted with
+    the clues; its count is used as total_mines if that is not given.
+    '''
+    totals = [c for c in csp.cons if isinstance(c, TotalCountConstraint) and c.value == mine]
+    if totals and total_mines is None:
+        total_mines = totals[0].count
+
+    probs = dict()
+    components = []
+    free = []
+    offset = 0  #mines on variables that can only be mines
+    for component in csp.get_components(totals):
+        if len(component) == 1 and all(c in totals for c in csp.vars_to_cons[component[0]]):
+            var = component[0]
+            dom = var.cur_domain()
+            if not mine in dom:
+                probs[var] = Fraction(0)
+                continue
+            if len(dom) == 1:
+                probs[var] = Fraction(1)
+                offset = offset + 1
+                continue
+            if len(dom) == 2:
+                free.append(var)
+                continue
+        constraints = []
+        for var in component:
+            for c in csp.vars_to_cons[var]:
+                if not c in constraints and not c in totals:
+                    constraints.append(c)
+        total, marginals = count_component(component, constraints, mine)
+        if not any(total):
+            return None
+        components.append((component, total, marginals))
+
+    if total_mines is None:
+        for component, total, marginals in components:
+            n = sum(total)
+            for var, marginal in zip(component, marginals):
+                probs[var] = Fraction(sum(marginal), n)
+        for var in free:
+            probs[var] = Fraction(1, 2)
+    else:
+        remaining = total_mines - offset
+        nfree = len(free)
+        #prefix[j] and suffix[j] count mines over components before/from j
+        prefix = [[1]]
+        for component, total, marginals in components:
+            prefix.append(poly_mul(prefix[-1], total))
+        suffix = [[1]]
+        for component, total, marginals in reversed(components):
+            suffix.append(poly_mul(suffix[-1], total))
+        suffix.reverse()
+
+        everything = prefix[-1]
+        n = sum(ways * binomial(nfree, remaining - k) for k, ways in enumerate(everything))
+        if n == 0:
+            return None
+
+        for j, (component, total, marginals) in enumerate(components):
+            rest = poly_mul(prefix[j], suffix[j + 1])
+            #weight[k]: ways to complete the board when this component has k mines
+            weight = [sum(ways * binomial(nfree, remaining - k - k2)
+                          for k2, ways in enumerate(rest))
+                      for k in range(len(total))]
+            for var, marginal in zip(component, marginals):
+                probs[var] = Fraction(sum(ways * weight[k] for k, ways in enumerate(marginal)), n)
+        if free:
+            ways = sum(w * binomial(nfree - 1, remaining - k - 1) for k, w in enumerate(everything))
+            for var in free:
+                probs[var] = Fraction(ways, n)
+
+    if not exact:
+        for var in probs:
+            probs[var] = float(probs[var])
+    if variable_array is None:
+        return probs
+    return probability_grid(variable_array, probs)
+
+
+def probability_grid(variable_array, probs):
+    '''Return nested lists shaped like variable_array holding probs[var]'''
+    if isinstance(variable_array, list):
+        return [probability_grid(item, probs) for item in variable_array]
+    return probs[variable_array]
+
+
+def count_component(variables, constraints, mine):
+    '''
+    Count the solutions over variables (in that order) of constraints,
+    whose scopes must lie within variables. Returns (total, marginals):
+    total[k] is the number of solutions with k mines, and marginals[i][k]
+    the number of those in which variables[i] is a mine.
+    '''
+    n = len(variables)
+    order = dict()
+    for i, var in enumerate(variables):
+        order[var] = i
+
+    #for each step i: the constraints opened at i, the constraints open
+    #after i, and (constraint, position in scope, scope variables still to
+    #come) for the constraints over variables[i]
+    opening = [[] for i in range(n)]
+    touching = [[] for i in range(n)]
+    last = dict()
+    for c in constraints:
+        idx = sorted(order[var] for var in c.scope)
+        if not idx:
+            continue
+        opening[idx[0]].append(c)
+        last[c] = idx[-1]
+        for p, var in enumerate(c.scope):
+            i = order[var]
+            touching[i].append((c, p, len(idx) - 1 - idx.index(i)))
+    after = []
+    active = []
+    for i in range(n):
+        active = [c for c in active + opening[i] if last[c] > i]
+        after.append(active)
+    before = [[]] + after[:-1]
+
+    def step(i, state, val):
+        '''State after giving variables[i] the value val, None if some
+           constraint can no longer be satisfied'''
+        seen = dict(zip(before[i], state))
+        for c in opening[i]:
+            if isinstance(c, CountConstraint):
+                seen[c] = 0
+            else:
+                seen[c] = (None,) * len(c.scope)
+        for c, p, to_come in touching[i]:
+            x = seen[c]
+            if isinstance(c, CountConstraint):
+                if val == c.value:
+                    x = x + 1
+                if x > c.count or x + to_come < c.count:
+                    return None
+            else:
+                x = x[:p] + (val,) + x[p + 1:]
+                if to_come == 0 and not c.check(x):
+                    return None
+            seen[c] = x
+        return tuple(seen[c] for c in after[i])
+
+    #forward pass: layers[i] maps each state before variables[i] to the
+    #mine polynomial of the ways of reaching it
+    layers = [{(): [1]}]
+    for i, var in enumerate(variables):
+        layer = dict()
+        for state, ways in layers[i].items():
+            for val in var.cur_domain():
+                new = step(i, state, val)
+                if new is not None:
+                    poly_add(layer.setdefault(new, []), ways, val == mine)
+        layers.append(layer)
+
+    #backward pass: completions[state] is the mine polynomial of the ways
+    #of completing the assignment from state
+    completions = dict()
+    if () in layers[n]:
+        completions[()] = [1]
+    marginals = [None] * n
+    for i in range(n - 1, -1, -1):
+        var = variables[i]
+        previous = dict()
+        marginal = []
+        for state, ways in layers[i].items():
+            acc = []
+            for val in var.cur_domain():
+                new = step(i, state, val)
+                if new is None or not new in completions:
+                    continue
+                poly_add(acc, completions[new], val == mine)
+                if val == mine:
+                    poly_add(marginal, poly_mul(ways, completions[new]), 1)
+            if acc:
+                previous[state] = acc
+        marginals[i] = marginal
+        completions = previous
+    return completions.get((), []), marginals
+
+
+def poly_add(acc, poly, shift):
+    '''acc += poly * x**shift, in place'''
+    while len(acc) < len(poly) + shift:
+        acc.append(0)
+    for k, a in enumerate(poly):
+        acc[k + shift] = acc[k + shift] + a
+
+
+def poly_mul(a, b):
+    '''Return the product of two polynomials'''
+    if not a or not b:
+        return []
+    product = [0] * (len(a) + len(b) - 1)
+    for i, x in enumerate(a):
+        if x:
+            for j, y in enumerate(b):
+                product[i + j] = product[i + j] + x * y
+    return product
+
+
+def binomial(n, k):
+    '''C(n, k), 0 if k is out of range'''
+    if k < 0 or k > n:
+        return 0
+    return comb(n, k)
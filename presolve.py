@@ -0,0 +1,301 @@
+'''
+Deterministic inference run on a CSP before backtracking search.
+
+Each CountConstraint whose undecided variables are all two valued is
+read as a linear equation over 0/1 unknowns: x_v = 1 if v takes the
+counted value, 0 if it takes its other value, and the sum of the x_v
+equals the count minus the number of variables that must take the value.
+On a minesweeper board these are the clue equations.
+
+presolve repeatedly applies to those equations
+   - the trivial rule: a sum of 0, or a sum equal to the number of
+     unknowns, fixes every unknown in it;
+   - the subset rule: if the unknowns of A are a subset of those of B,
+     then B - A holds count(B) - count(A) of the value (a new equation);
+   - the overlap rule: if count(B) - count(A) equals |B - A| then all of
+     B - A take the value and none of A - B do;
+   - Gaussian elimination over all the equations, reading each reduced
+     row as bounds: if its right hand side equals the sum of its
+     positive (or negative) coefficients the row fixes all its unknowns.
+
+until nothing more can be fixed. The fixed variables are assigned and a
+smaller CSP over the rest is returned for bt_search.
+
+Constraints with incremental counters (TotalCountConstraint, e.g. the
+total number of mines) span the whole board and are only carried over to
+the smaller CSP, not reasoned with.
+'''
+
+from fractions import Fraction
+from cspbase import *
+
+
+class Contradiction(Exception):
+    '''Raised internally when the equations have no 0/1 solution'''
+
+
+def presolve(csp):
+    '''
+    Fix as many variables of csp as the rules above allow. The fixed
+    variables are assigned their value (so they show up in e.g. the
+    minesweeper variable_array). Variables whose current domain has a
+    single value are fixed to it as well.
+
+    Returns (reduced_csp, n_fixed): a CSP over the variables that are
+    still undecided, with constraints restricted to them (their
+    variables keep counting for them, see Constraint.attach, until they
+    are removed from reduced_csp), and the number of variables removed
+    from the search. reduced_csp is None if the inference found that the
+    CSP has no solution (nothing is assigned in that case).
+    '''
+    fixed = dict()
+    for var in csp.vars:
+        if var.is_assigned():
+            fixed[var] = var.get_assigned_value()
+        elif var.cur_domain_size() == 1:
+            fixed[var] = var.cur_domain()[0]
+    n_assigned = sum(1 for var in csp.vars if var.is_assigned())
+
+    try:
+        infer(csp, fixed)
+        reduced = reduced_csp(csp, fixed)
+    except Contradiction:
+        return None, 0
+
+    for var, val in fixed.items():
+        if not var.is_assigned():
+            var.assign(val)
+    return reduced, len(fixed) - n_assigned
+
+
+def infer(csp, fixed):
+    '''Add to fixed (dict var -> value) every variable the rules can fix'''
+    pos = dict()
+    for i, var in enumerate(csp.vars):
+        pos[var] = i
+
+    #each equation is keyed by (value, frozenset of unknowns) -> count
+    eqs = dict()
+    for c in csp.cons:
+        if isinstance(c, CountConstraint) and not c.incremental:
+            add_equation(eqs, c.value, c.scope, c.count, fixed)
+
+    while True:
+        eqs = substitute(eqs, fixed)
+        if trivial_rule(eqs, fixed):
+            continue
+        if subset_rules(eqs, fixed):
+            continue
+        if not gaussian_rule(eqs, fixed, pos):
+            return
+
+
+def add_equation(eqs, value, scope, count, fixed):
+    '''Add the equation "count of scope take value" if its undecided
+       variables are all two valued (with value one of the two)'''
+    unknowns = []
+    for var in scope:
+        if var in fixed:
+            if fixed[var] == value:
+                count = count - 1
+        elif var.cur_domain_size() == 2 and var.in_cur_domain(value):
+            unknowns.append(var)
+        elif var.in_cur_domain(value):
+            return
+    put_equation(eqs, value, frozenset(unknowns), count)
+
+
+def put_equation(eqs, value, unknowns, count):
+    '''Add an equation, checking it against bounds and any equation over
+       the same unknowns. Returns True if it is new.'''
+    if count < 0 or count > len(unknowns):
+        raise Contradiction()
+    if not unknowns:
+        return False
+    key = (value, unknowns)
+    if key in eqs:
+        if eqs[key] != count:
+            raise Contradiction()
+        return False
+    eqs[key] = count
+    return True
+
+
+def substitute(eqs, fixed):
+    '''Return the equations with the fixed variables taken out'''
+    new = dict()
+    for (value, unknowns), count in eqs.items():
+        if any(var in fixed for var in unknowns):
+            rest = []
+            for var in unknowns:
+                if not var in fixed:
+                    rest.append(var)
+                elif fixed[var] == value:
+                    count = count - 1
+            unknowns = frozenset(rest)
+        put_equation(new, value, unknowns, count)
+    return new
+
+
+def fix(fixed, var, value, is_value):
+    '''Fix var to value (is_value True) or to its other value'''
+    if not is_value:
+        value = [other for other in var.cur_domain() if other != value][0]
+    if var in fixed:
+        if fixed[var] != value:
+            raise Contradiction()
+        return False
+    fixed[var] = value
+    return True
+
+
+def trivial_rule(eqs, fixed):
+    '''Fix the unknowns of equations with a count of 0 or of all of them'''
+    changed = False
+    for (value, unknowns), count in eqs.items():
+        if count == 0 or count == len(unknowns):
+            for var in unknowns:
+                if fix(fixed, var, value, count > 0):
+                    changed = True
+    return changed
+
+
+def subset_rules(eqs, fixed):
+    '''Apply the subset and overlap rules to each pair of equations
+       sharing a variable'''
+    by_var = dict()
+    for key in eqs:
+        for var in key[1]:
+            by_var.setdefault(var, []).append(key)
+
+    changed = False
+    derived = []
+    for a in eqs:
+        value, unknowns = a
+        others = set()
+        for var in unknowns:
+            for b in by_var[var]:
+                if b != a and b[0] == value:
+                    others.add(b)
+        for b in others:
+            extra = eqs[b] - eqs[a]
+            if unknowns < b[1]:
+                derived.append((value, b[1] - unknowns, extra))
+            elif extra > 0 and extra == len(b[1] - unknowns):
+                for var in b[1] - unknowns:
+                    changed = fix(fixed, var, value, True) or changed
+                for var in unknowns - b[1]:
+                    changed = fix(fixed, var, value, False) or changed
+
+    for value, unknowns, count in derived:
+        changed = put_equation(eqs, value, unknowns, count) or changed
+    return changed
+
+
+def gaussian_rule(eqs, fixed, pos):
+    '''Bring the equations of each counted value to reduced row echelon
+       form and apply the bounds rule to every row. The rows are sparse
+       dicts, and pivots are chosen in the order of the CSP's variables
+       so fill-in stays within the band of neighbouring cells.'''
+    changed = False
+    values = set(value for value, unknowns in eqs)
+    for value in values:
+        rows = []
+        for (v, unknowns), count in eqs.items():
+            if v == value:
+                rows.append(({var: Fraction(1) for var in unknowns}, Fraction(count)))
+        for coeffs, count in eliminate(rows, pos):
+            pos_sum = sum(a for a in coeffs.values() if a > 0)
+            neg_sum = sum(a for a in coeffs.values() if a < 0)
+            if count < neg_sum or count > pos_sum:
+                raise Contradiction()
+            if count == pos_sum or count == neg_sum:
+                for var, a in coeffs.items():
+                    if fix(fixed, var, value, (a > 0) == (count == pos_sum)):
+                        changed = True
+    return changed
+
+
+def eliminate(rows, pos):
+    '''Gauss-Jordan elimination of rows (pairs (dict var -> coefficient,
+       right hand side)). Returns the non-zero rows of the result.'''
+    pivots = dict()     #pivot variable -> [coeffs, rhs] of its row
+    column = dict()     #variable -> set of pivot variables whose row has it
+    for coeffs, rhs in rows:
+        coeffs = dict(coeffs)
+        for var in [var for var in coeffs if var in pivots]:
+            factor = coeffs.get(var)
+            if factor:
+                prow, prhs = pivots[var]
+                for pvar, a in prow.items():
+                    coeffs[pvar] = coeffs.get(pvar, 0) - factor * a
+                    if coeffs[pvar] == 0:
+                        del coeffs[pvar]
+                rhs = rhs - factor * prhs
+        if not coeffs:
+            if rhs != 0:
+                raise Contradiction()
+            continue
+
+        pvar = min(coeffs, key=pos.get)
+        lead = coeffs[pvar]
+        for var in coeffs:
+            coeffs[var] = coeffs[var] / lead
+        rhs = rhs / lead
+        row = [coeffs, rhs]
+
+        #eliminate the new pivot from the earlier rows
+        for q in column.pop(pvar, ()):
+            qrow = pivots[q]
+            factor = qrow[0].pop(pvar)
+            for var, a in coeffs.items():
+                if var == pvar:
+                    continue
+                new = qrow[0].get(var, 0) - factor * a
+                if new == 0:
+                    qrow[0].pop(var, None)
+                    column[var].discard(q)
+                else:
+                    qrow[0][var] = new
+                    column.setdefault(var, set()).add(q)
+            qrow[1] = qrow[1] - factor * rhs
+        pivots[pvar] = row
+        for var in coeffs:
+            if var != pvar:
+                column.setdefault(var, set()).add(pvar)
+
+    return [(coeffs, rhs) for coeffs, rhs in pivots.values()]
+
+
+def reduced_csp(csp, fixed):
+    '''Return the CSP over the variables not in fixed, with each
+       constraint restricted to them. The constraints are only added to
+       the CSP once they are all built, so a contradiction leaves none
+       of them registered with the (shared) variables.'''
+    constraints = []
+    for c in csp.cons:
+        scope = [var for var in c.scope if not var in fixed]
+        if isinstance(c, CountConstraint):
+            count = c.count - sum(1 for var in c.scope
+                                  if var in fixed and fixed[var] == c.value)
+            if count < 0 or count > len(scope):
+                raise Contradiction()
+            if scope:
+                constraints.append(type(c)(c.name, scope, c.value, count))
+            continue
+
+        tuples = []
+        for t in c.sat_tuples:
+            if all(fixed[var] == val for var, val in zip(c.scope, t) if var in fixed):
+                tuples.append([val for var, val in zip(c.scope, t) if not var in fixed])
+        if not tuples:
+            raise Contradiction()
+        if scope:
+            constraint = Constraint(c.name, scope)
+            constraint.add_satisfying_tuples(tuples)
+            constraints.append(constraint)
+
+    reduced = CSP(csp.name, [var for var in csp.vars if not var in fixed])
+    for constraint in constraints:
+        reduced.add_constraint(constraint)
+    return reduced
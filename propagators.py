@@ -1,3 +1,6 @@
+from collections import deque
+from cspbase import trail_propagator
+
 #Look for #IMPLEMENT tags in this file. These tags indicate what has
 #to be implemented to complete the warehouse domain.  
 
@@ -34,6 +37,13 @@
       NOTE propagator SHOULD NOT prune a value that has already been 
       pruned! Nor should it prune a value twice
 
+      The propagators below are decorated with trail_propagator (see
+      cspbase). bt_search calls them as propagator(csp, newVar, trail)
+      and they prune through trail.prune(var, val), which records each
+      pruning on the search's trail instead of building a list; only
+      True/False is returned. Called without a trail they still follow
+      the template above and return (True/False, prunings).
+
       PROPAGATOR called with newly_instantiated_variable = None
       PROCESSING REQUIRED:
         for plain backtracking (where we only check fully instantiated constraints)
@@ -59,95 +69,136 @@
          
    '''
 
-def prop_BT(csp, newVar=None):
+@trail_propagator
+def prop_BT(csp, newVar=None, trail=None):
     '''Do plain backtracking propagation. That is, do no 
     propagation at all. Just check fully instantiated constraints'''
     
     if not newVar:
-        return True, []
+        return True
+    listeners = trail.listeners
     for c in csp.get_cons_with_var(newVar):
         if c.get_n_unasgn() == 0:
             vals = []
             vars = c.get_scope()
             for var in vars:
                 vals.append(var.get_assigned_value())
+            if listeners:
+                for l in listeners:
+                    l.revised(c, 0)
             if not c.check(vals):
-                return False, []
-    return True, []
+                trail.fail(c)
+                return False
+    return True
 
-def prop_FC(csp, newVar=None):
+@trail_propagator
+def prop_FC(csp, newVar=None, trail=None):
     '''Do forward checking. That is check constraints with 
-       only one uninstantiated variable. Remember to keep 
-       track of all pruned variable,value pairs and return '''
+       only one uninstantiated variable. Remember to record
+       all pruned variable,value pairs on the trail '''
 #IMPLEMENT
-    pruned = []
-    # keep track of pruned values
     if newVar:
-        constraints = csp.get_cons_with_var(newVar)
-        # get constraints involving the variable if a variable is given
+        constraints = csp.vars_to_cons[newVar]
+        # get constraints involving the variable if a variable is given (not copied, FC only reads it)
     else:
         constraints = csp.get_all_cons()
         # get all constraints if no variable is given
+    listeners = trail.listeners
+    # search listeners to tell of each constraint checked (see cspbase.SearchListener)
 
     for constraint in constraints:
-        if constraint.get_n_unasgn() == 1:
+        if constraint.n_unasgn == 1:
             # iterate through all constraints with only 1 unassigned variable
+            # (the counter is kept up to date by the variables, no rescan)
 
-            variable = constraint.get_unasgn_vars()[0]
-            for d in variable.cur_domain():
-                # try all the values in the domain of that variable
+            variable = constraint.get_unasgn_var()
+            size = variable.cur_domain_size()
+            for d in variable.dom:
+                # try all the values still in the domain of that variable
 
-                variable.assign(d)
-                values = []
-                for var in constraint.get_scope():
-                    values.append(var.get_assigned_value())
-                    # fill the list "values" with assigned values of the variables in the scope of the constraint
-
-                if not constraint.check(values):
-                    variable.prune_value(d)
-                    pruned.append((variable, d))
-                    # if these values do not pass the constraint check, prune the assigned value from domain
-
-                variable.unassign() # unassign variable
+                if variable.in_cur_domain(d) and not constraint.has_support(variable, d):
+                    trail.prune(variable, d, constraint)
+                    # with the rest of the scope assigned, a value without support
+                    # is one that fails the constraint check: prune it from domain
 
+            if listeners:
+                for l in listeners:
+                    l.revised(constraint, size - variable.cur_domain_size())
             if variable.cur_domain_size() == 0:
-                return False, pruned
+                return False
                 # return false if nothing is left in domain after the prune
 
-    return True, pruned
+        elif constraint.incremental:
+            # constraints keeping incremental counters (e.g. the total number of mines)
+            # check their bounds on every assignment, in O(1) unless the bounds are tight
+
+            unsupported = constraint.get_unsupported()
+            if listeners:
+                for l in listeners:
+                    l.revised(constraint, len(unsupported))
+            for variable, d in unsupported:
+                trail.prune(variable, d, constraint)
+                if variable.cur_domain_size() == 0:
+                    return False
+
+    return True
     # return true if there's still values left in the domain after all the prunes
 
-def prop_GAC(csp, newVar=None):
+@trail_propagator
+def prop_GAC(csp, newVar=None, trail=None):
     '''Do GAC propagation. If newVar is None we do initial GAC enforce 
        processing all constraints. Otherwise we do GAC enforce with
        constraints containing newVar on GAC Queue'''
 #IMPLEMENT
-    pruned = []
     if newVar:
         constraints = csp.get_cons_with_var(newVar)
         # get constraints involving the variable if a variable is given
     else:
         constraints = csp.get_all_cons()
         # get all constraints if no variable is given
-
-    while constraints:
-        constraint = constraints.pop(0)
+    return gac_enforce(csp, constraints, trail)
+
+def gac_enforce(csp, constraints, trail):
+    '''Enforce GAC with the GAC queue initialized to constraints, pruning
+       through trail. Only constraints on the queue, and those of variables
+       that lose a value, are revised, so the work done follows the changes
+       rather than the size of the csp. Returns False on a domain wipe out.'''
+    queue = deque(constraints)
+    in_queue = set(queue)
+    # constraints currently on the queue, so membership tests are O(1)
+    listeners = trail.listeners
+    # search listeners to tell of each constraint revised (see cspbase.SearchListener)
+
+    while queue:
+        constraint = queue.popleft()
+        in_queue.discard(constraint)
         # while the queue still has constraints in it, take one out and work on it
 
-        for variable in constraint.get_scope():
-            for d in variable.cur_domain():
-                # iterate through all the values in the domain of the variables in the constraint
-
-                if not constraint.has_support(variable, d):
-                    variable.prune_value(d)
-                    pruned.append((variable,d))
-                    # prune the value from domain of variable if it has no support
-
-                    if variable.cur_domain_size() == 0:
-                        return False, pruned
-                        # return false after the prune if domain becomes empty
-                    else:
-                        constraints += list(set(csp.get_cons_with_var(variable)) - set(constraints))
-                        # otherwise add constraints involving the changed variable to the queue and continue
-    return True, pruned
+        unsupported = constraint.get_unsupported()
+        if listeners:
+            for l in listeners:
+                l.revised(constraint, len(unsupported))
+        for variable, d in unsupported:
+            # iterate through all the values in the domain of the variables in the constraint
+            # that have no support (counting constraints find these without any tuples)
+
+            if variable.is_assigned():
+                trail.fail(constraint)
+                return False
+                # the value of an assigned variable has no support: the constraint is violated
+                # (pruning it would change nothing and put the constraint back on the queue)
+
+            trail.prune(variable, d, constraint)
+            # prune the value from domain of variable if it has no support
+
+            if variable.cur_domain_size() == 0:
+                return False
+                # return false after the prune if domain becomes empty
+            else:
+                for c in csp.get_cons_with_var(variable):
+                    if not c in in_queue:
+                        in_queue.add(c)
+                        queue.append(c)
+                # otherwise add constraints involving the changed variable to the queue and continue
+    return True
     # return true if supporting tuple exists in all the constraints for the changed variable